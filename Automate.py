@@ -1,20 +1,31 @@
 r""" This program takes nmap output file .gnmap and parses it for open ports
 The functions:
     nmap_parser: Parses the nmap output file and creates a directory for the results
+    parse: Parses files into a HostInfo when used as a library
+    iter_hosts: Yields the hosts of a file one at a time
+    export: Writes the results of a HostInfo to a directory
     options: Gets the options from the command line
     main: Runs the program
 Output:
-    HostInfo.saveDir: Directory with the results
-    HostInfo.saveDirPorts: Directory with the open ports
+    info.saveDir: Directory with the results
+    info.saveDirPorts: Directory with the open ports
     LOGFILE: Log
 By: Timothy Stowe
 Date: 11/27/2022
 """
 
+import atexit
+import contextlib
+import glob
+import ipaddress
 import logging
+import logging.handlers
 import os
+import queue
 import random
+import re
 import shutil
+import socket
 import sys
 import time
 
@@ -28,6 +39,20 @@ VERSION = "0.0.6"
 LOGFILE = "Automate.log"
 INPUTFILE = ""  # Leave blank unless you want to specify before running
 SUPPORTEDFILES = ["xml", "gnmap"]
+# Compressed inputs are read as a stream, picked by these magic bytes
+COMPRESSIONS = {"gz": b"\x1f\x8b", "xz": b"\xfd7zXZ\x00", "bz2": b"BZh"}
+# Parsed results are cached here so a rerun on the same input skips parsing
+CACHEDIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "automate",
+)
+CACHESIZE = 2 * 1024**3  # Oldest snapshots are removed past this many bytes
+FOLLOWINTERVAL = 2  # Seconds between checks for new lines in --follow mode
+FOLLOWSUMMARY = 30  # Seconds between rewrites of HostInfo.txt in --follow mode
+BUFFERSIZE = 1024 * 1024  # Write buffer of the exporters
+CSVBATCH = 10000  # Rows per writerows call
+SCANCHUNK = 32 * 1024**2  # Bytes of a .gnmap per worker process, smaller is one process
+PLUGINENV = "AUTOMATE_PLUGINS"  # Plugin modules to load, split by os.pathsep
 # python -m auto_py_to_exe
 
 # ------------------------------------------------------------------------------
@@ -70,64 +95,452 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
-consoleFormatter = logging.Formatter("%(message)s")
-logging.basicConfig(
-    filename=LOGFILE,
-    level=logging.DEBUG,
-    format="%(asctime)s %(levelname)s %(lineno)d %(message)s",
-)
+class Log:
+    """
+    Log Class, the log file and console are written by a background thread
+        start: Routes every record through a queue to the writer thread
+        stop: Writes what is left in the queue and stops the thread
+        worker: Parser processes write to the log file themselves
+        set_trace: Turns on the per host and per port records (--trace)
+
+    Records are put on the queue as they are made and formatted and written
+    by the QueueListener, so the parser never waits on the log file. The hot
+    paths log to the trace logger, which is off unless --trace is given, and
+    each phase logs one summary record instead
+    """
+
+    queue = queue.SimpleQueue()
+    fileHandler = None
+    queueHandler = None
+    listener = None
+    # Per host and per port records, off unless --trace is given
+    trace = logging.getLogger("Automate.trace")
+
+    def start() -> None:
+        Log.fileHandler = logging.FileHandler(LOGFILE)
+        Log.fileHandler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(lineno)d %(message)s")
+        )
+        Log.queueHandler = logging.handlers.QueueHandler(Log.queue)
+        Log.listener = logging.handlers.QueueListener(
+            Log.queue, Log.fileHandler, consoleHandler, respect_handler_level=True
+        )
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(Log.queueHandler)
+        Log.trace.setLevel(logging.WARNING)
+        Log.listener.start()
+        atexit.register(Log.stop)
+
+    def stop() -> None:
+        # Runs from -c and again at exit, the listener is only stopped once
+        if Log.listener is not None:
+            Log.listener.stop()
+            Log.listener = None
+
+    def worker() -> None:
+        # A forked process has a copy of the queue but not the thread reading it
+        if Log.queueHandler is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(Log.queueHandler)
+        root.addHandler(Log.fileHandler)
+
+    def set_trace() -> None:
+        logging.getLogger().setLevel(logging.DEBUG)
+        Log.trace.setLevel(logging.DEBUG)
 
+
+consoleFormatter = logging.Formatter("%(message)s")
 consoleHandler = logging.StreamHandler()
 consoleHandler.setFormatter(CustomFormatter())
 consoleHandler.setLevel(logging.ERROR)
-logging.getLogger().addHandler(consoleHandler)
+
+
+# ------------------------------------------------------------------------------
+# Port Class
+# ------------------------------------------------------------------------------
+class Port:
+    """
+    One port of a host, stored in __slots__ instead of a seven key dict
+
+    The strings repeat on every host ("open", "tcp", "http", "80") so they are
+    interned and every port shares the same objects. A Port acts like the old
+    port dict for the exporters: .get(), ["key"], keys(), iterating over the
+    keys and dict(port) all work. Fields left as None (owner and rpc_info on
+    XML ports) are not keys, the same as before
+    """
+
+    __slots__ = ("port", "state", "protocol", "owner", "service", "rpc_info", "version")
+
+    def __init__(
+        self,
+        port="",
+        state="",
+        protocol="",
+        owner=None,
+        service="",
+        rpc_info=None,
+        version="",
+    ):
+        intern = sys.intern
+        self.port = intern(port)
+        self.state = intern(state)
+        self.protocol = intern(protocol)
+        self.owner = None if owner is None else intern(owner)
+        self.service = intern(service)
+        self.rpc_info = None if rpc_info is None else intern(rpc_info)
+        self.version = intern(version)
+
+    def keys(self) -> list:
+        return [key for key in Port.__slots__ if getattr(self, key) is not None]
+
+    def values(self) -> list:
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self) -> list:
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def get(self, key, default=None):
+        if key in Port.__slots__ and getattr(self, key) is not None:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key):
+        if key in Port.__slots__ and getattr(self, key) is not None:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value) -> None:
+        if key not in Port.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key) -> bool:
+        return key in Port.__slots__ and getattr(self, key) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Port, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
+
 
 # ------------------------------------------------------------------------------
 # HostInfo Class
 # ------------------------------------------------------------------------------
 class HostInfo:
+    # Fields of HostInfo.service_key, in the same order
+    INDEXED = ["port", "state", "protocol", "service", "version"]
+
     def __init__(self):
         self.inputFile = INPUTFILE
+        self.inputFiles = []  # Every input file when more than one is given
         self.all_service_list = []  # [{}, {}, {}]
+        # Same services as all_service_list keyed by HostInfo.service_key
+        self.service_registry = {}  # {(port, state, protocol, service, version): {}}
+        self.service_count = {}  # {(port, state, protocol, service, version): hosts}
+        # Inverted index of the hosts that have each service, kept in order
+        # {(port, state, protocol, service, version): {host: None}}
+        self.service_hosts = {}
+        # Service keys by the value of each of their fields, for --filter
+        # {field: {value: {(port, state, protocol, service, version): None}}}
+        self.field_index = {field: {} for field in HostInfo.INDEXED}
         self.host_dict = {}
         # host_dict["host"][0,1,2]["port"]
         self.numPors = {"tcp": 0, "udp": 0}
+        self.numLines = 0  # Lines read by the gnmap parser
+        self.registryTime = 0.0  # Seconds spent in update_host
+        self.fingerprints = None  # Of the inputs, worked out by Cache.load
+        # ([HostInfo.host_key, ...], [host, ...]) sorted, built by hosts_in
+        self.host_index = None
         self.saveDir = "nmap_results"
         self.saveDirPorts = self.saveDir + "/open_ports"
 
+    @staticmethod
+    def service_key(service) -> tuple:
+        return (
+            service.get("port"),
+            service.get("state"),
+            service.get("protocol"),
+            service.get("service"),
+            service.get("version"),
+        )
+
+    @staticmethod
+    def host_key(host) -> bytes:
+        """
+        Pass in a host and return its address packed as bytes with the IP
+        version in front, so hosts sort by number (10.0.0.2 before 10.0.0.10)
+        and IPv4 before IPv6. A host that isn't an address sorts after them
+        by name
+        """
+        # inet_pton is many times faster, ipaddress also takes IPv6 zones
+        for prefix, family in ((b"\x04", socket.AF_INET), (b"\x06", socket.AF_INET6)):
+            try:
+                return prefix + socket.inet_pton(family, host)
+            except (OSError, TypeError):
+                pass
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return b"\xff" + str(host).encode()
+        return bytes([address.version]) + address.packed
+
+    @staticmethod
+    def address_range(network) -> tuple:
+        """
+        Pass in a CIDR (10.0.0.0/24), a range (10.0.0.5-10.0.0.20) or one
+        address and return the (first, last) HostInfo.host_key it covers
+
+        Raises ValueError if it isn't one of those
+        """
+        if "-" in network:
+            first, last = (
+                ipaddress.ip_address(a.strip()) for a in network.split("-", 1)
+            )
+            if first.version != last.version:
+                raise ValueError("%s mixes IPv4 and IPv6" % network)
+        else:
+            network = ipaddress.ip_network(network.strip(), strict=False)
+            first, last = network.network_address, network.broadcast_address
+        return (
+            bytes([first.version]) + first.packed,
+            bytes([last.version]) + last.packed,
+        )
+
+    @staticmethod
+    def cidrs(hosts) -> list:
+        """
+        Pass in hosts and return them collapsed into the fewest CIDR blocks,
+        IPv4 then IPv6 in order. Hosts that aren't addresses are kept as they are
+        """
+        numbers, names = {4: [], 6: []}, []
+        for host in hosts:
+            key = HostInfo.host_key(host)
+            # A zone (fe80::1%eth0) would be lost in a block
+            if key[0] not in numbers or "%" in host:
+                names.append(host)
+                continue
+            numbers[key[0]].append(int.from_bytes(key[1:], "big"))
+        blocks = []
+        for version, found in numbers.items():
+            family, width = (
+                (socket.AF_INET, 32) if version == 4 else (socket.AF_INET6, 128)
+            )
+            found.sort()
+            # Each run of consecutive addresses becomes the blocks that cover it,
+            # worked out on the ints, ipaddress.summarize_address_range is
+            # too slow for a scan with many short runs
+            start = 0
+            for i in range(1, len(found) + 1):
+                if i < len(found) and found[i] <= found[i - 1] + 1:
+                    continue
+                first, last = found[start], found[i - 1]
+                while first <= last:
+                    # The biggest block aligned on first that ends by last
+                    size = first & -first or 1 << width
+                    while first + size - 1 > last:
+                        size >>= 1
+                    address = socket.inet_ntop(
+                        family, first.to_bytes(width // 8, "big")
+                    )
+                    blocks.append("%s/%s" % (address, width - size.bit_length() + 1))
+                    first += size
+                start = i
+        return blocks + names
+
+    def hosts_in(self, network) -> list:
+        """
+        Pass in a CIDR, a range or one address (see address_range) and return
+        the hosts in it in order, found by binary search on host_index
+        """
+        import bisect
+
+        first, last = HostInfo.address_range(network)
+        if self.host_index is None:
+            order = sorted((HostInfo.host_key(host), host) for host in self.host_dict)
+            self.host_index = ([key for key, _ in order], [host for _, host in order])
+        keys, hosts = self.host_index
+        return hosts[bisect.bisect_left(keys, first) : bisect.bisect_right(keys, last)]
+
     def update_host(self, update=None, os=None) -> None:
         # update = {"host": [{"port": 80, "state": "open", "protocol": "tcp", "owner": "root", "service": "http"}]}
         if update:
-            logging.debug("updating self.host_dict with: %s", update)
-            self.host_dict.update(update)
+            Log.trace.debug("updating self.host_dict with: %s", update)
         if os:
-            logging.debug("Found Os: %s", os)
-            pass
-        host = list(update.keys())[0]
-        for service in update[host]:
-            self.__setnumbs(service)
-            self.__setservice(service)
-
-    def __setservice(self, service) -> None:
+            Log.trace.debug("Found Os: %s", os)
+        start = time.perf_counter()
+        if update:
+            self.host_index = None
+        for host in update or {}:
+            # A host that is seen again replaces what was stored for it
+            if host in self.host_dict:
+                self.__removehost(host)
+            self.host_dict[host] = update[host]
+            for service in update[host]:
+                self.__setnumbs(service)
+                self.__setservice(host, service)
+        self.registryTime += time.perf_counter() - start
+
+    def iter_hosts(self):
+        # (host, ports) in order, the exporters read the results through this
+        return iter(self.host_dict.items())
+
+    def sort_hosts(self) -> None:
+        # Hosts are added in the order they are found, put them back in
+        # address order. The key of each host is worked out once and the
+        # service lists are sorted by its place in host_dict
+        order = sorted(self.host_dict, key=HostInfo.host_key)
+        self.host_dict = {host: self.host_dict[host] for host in order}
+        rank = {host: i for i, host in enumerate(order)}
+        for key in self.service_hosts:
+            self.service_hosts[key] = dict.fromkeys(
+                sorted(self.service_hosts[key], key=rank.__getitem__)
+            )
+
+    def __setservice(self, host, service) -> None:
+        key = HostInfo.service_key(service)
+        if key in self.service_count:
+            self.service_count[key] += 1
+            self.service_hosts[key][host] = None
+            Log.trace.debug("Service already in all_services_dict %s", key)
+            return
         __temp_dict = {
-            "port": service.get("port"),
-            "state": service.get("state"),
-            "protocol": service.get("protocol"),
-            "service": service.get("service"),
-            "version": service.get("version"),
+            "port": key[0],
+            "state": key[1],
+            "protocol": key[2],
+            "service": key[3],
+            "version": key[4],
         }
-        if __temp_dict not in self.all_service_list:
-            self.all_service_list.append(__temp_dict)
-            logging.debug("Added service to all_services_dict {}".format(__temp_dict))
-            return
-        logging.debug("Service already in all_services_dict {}".format(__temp_dict))
-
-    def __setnumbs(self, service) -> None:
+        self.service_registry[key] = __temp_dict
+        self.service_count[key] = 1
+        self.service_hosts[key] = {host: None}
+        for field, value in zip(HostInfo.INDEXED, key):
+            self.field_index[field].setdefault(value, {})[key] = None
+        self.all_service_list.append(__temp_dict)
+        Log.trace.debug("Added service to all_services_dict %s", __temp_dict)
+
+    def __setnumbs(self, service, step=1) -> None:
         if service.get("protocol") == "tcp":
-            self.numPors["tcp"] += 1
-            logging.debug(f"TCP updated to: {self.numPors['tcp']}")
+            self.numPors["tcp"] += step
+            Log.trace.debug("TCP updated to: %s", self.numPors["tcp"])
         if service.get("protocol") == "udp":
-            logging.debug(f"UDP updated to: {self.numPors['udp']}")
+            self.numPors["udp"] += step
+            Log.trace.debug("UDP updated to: %s", self.numPors["udp"])
+
+    def __removehost(self, host) -> None:
+        Log.trace.debug("Removing %s before it is updated", host)
+        for service in self.host_dict.pop(host):
+            self.__setnumbs(service, step=-1)
+            key = HostInfo.service_key(service)
+            self.service_count[key] -= 1
+            self.service_hosts[key].pop(host, None)
+            if self.service_count[key] == 0:
+                del self.service_count[key]
+                del self.service_hosts[key]
+                for field, value in zip(HostInfo.INDEXED, key):
+                    keys = self.field_index[field][value]
+                    del keys[key]
+                    if not keys:
+                        del self.field_index[field][value]
+                self.all_service_list.remove(self.service_registry.pop(key))
+
+
+# ------------------------------------------------------------------------------
+# Compressed Streams
+# ------------------------------------------------------------------------------
+class Stream:
+    """
+    Opens scans and results that may be compressed with gzip, xz or bz2
+
+    An input is decompressed as it is read, nothing is unpacked to disk.
+    The compression is picked from the magic bytes so a scan is read the
+    same with or without its .gz/.xz/.bz2 suffix
+    """
+
+    MODULES = {"gz": "gzip", "xz": "lzma", "bz2": "bz2"}
+
+    def compression(file) -> str:
+        # "gz", "xz", "bz2" or None for a plain file
+        with open(file, "rb") as f:
+            head = f.read(max(len(m) for m in COMPRESSIONS.values()))
+        for name, magic in COMPRESSIONS.items():
+            if head.startswith(magic):
+                return name
+        return None
+
+    def strip(file) -> str:
+        # scan.gnmap.gz -> scan.gnmap
+        base, ext = os.path.splitext(file)
+        return base if ext[1:] in COMPRESSIONS else file
+
+    def kind(file, sniff=True) -> str:
+        """
+        Returns "gnmap", "xml" or "nmap" for file, None if it isn't a scan
+
+        The suffix under the compression suffix is used (scan.gnmap.gz), a
+        compressed file without one (scan.gz) is told apart by the start of
+        its data when sniff is set
+        """
+        ext = os.path.splitext(Stream.strip(file))[1][1:]
+        if ext in SUPPORTEDFILES + ["nmap"]:
+            return ext
+        if not sniff or not os.path.isfile(file):
+            return None
+        try:
+            if Stream.strip(file) == file and not Stream.compression(file):
+                return None
+            with Stream.open(file, "rb") as f:
+                head = f.read(4096)
+        except Exception as e:
+            logging.debug("Could not read %s (%s)", file, e)
+            return None
+        if b"<nmaprun" in head:
+            return "xml"
+        if head.startswith(b"Host: ") or b"\nHost: " in head:
+            return "gnmap"
+        return None
+
+    def open(file, mode="rt"):
+        """
+        Opens file for reading, decompressing it if it's compressed
+
+        Text mode uses the same encoding and newlines as open(), bytes that
+        don't decode are replaced like the mmap and --follow readers do
+        """
+        import importlib
+
+        kwargs = {} if "b" in mode else {"errors": "replace"}
+        compression = Stream.compression(file)
+        if compression is None:
+            return open(file, mode, **kwargs)
+        module = importlib.import_module(Stream.MODULES[compression])
+        return module.open(file, mode, **kwargs)
+
+    def create(file, compression=None):
+        """
+        Opens file for writing text, with a compression its suffix is added
+        to the name. gzip is written at level 6, level 9 is several times
+        slower for a few percent smaller output
+        """
+        import importlib
+
+        if compression is None:
+            return open(file, "w", buffering=BUFFERSIZE)
+        module = importlib.import_module(Stream.MODULES[compression])
+        options = {"compresslevel": 6} if compression == "gz" else {}
+        return module.open(file + "." + compression, "wt", **options)
 
 
 # ------------------------------------------------------------------------------
@@ -143,84 +556,209 @@ class Files:
         save_xml: Saves the results to a xml file
         save_csv: Saves the results to a csv file
         save_sql3: Saves the results to a sql3 file
+        save_cidr_file: Saves the live hosts of each service as CIDR blocks
+        register: Adds a writer to the formats --formats can pick
+        select: The writers of the formats picked with --formats
+        load_plugins: Imports the --plugin and AUTOMATE_PLUGINS modules
+
+    A writer is called with the HostInfo to write and the Flag options and
+    writes its files to info.saveDir. A plugin module registers its own with
+        import Automate
+        Automate.Files.register("name", writer)
     """
 
-    def set_save_dir() -> None:
-        infi = HostInfo.inputFile.split(".")
+    # Format name: writer or "module:function", in the order save_all runs them
+    exporters = {}
+
+    def set_save_dir(info, flags) -> None:
+        # scan.gnmap.gz, dir/scan.gnmap and scan.gz all give scan
+        infi = os.path.splitext(os.path.basename(Stream.strip(info.inputFile)))[0]
+        # Results of more than one input file go into one directory
+        if len(info.inputFiles) > 1:
+            infi = "combined"
+        # A diff goes in a directory named after both scans
+        if flags.diff:
+            infi = (
+                "_".join(
+                    os.path.splitext(os.path.basename(Stream.strip(f)))[0]
+                    for f in flags.diff
+                )
+                + "_diff"
+            )
         invalid_chars = "\<>:|?*;=!^"
-        if len(infi) == 2:
-            infi = infi[0]
-            HostInfo.saveDirPorts = HostInfo.saveDir + "/open_ports"
-        elif len(infi) == 3:
-            infi = infi[0] + infi[1]
         if infi == "":
             infi = "set_save_dir"
         for char in infi:
             if char in "\ ":
                 infi = infi.replace(char, "")
-                logging.debug(f"Removed {char} from {infi}")
+                logging.debug("Removed %s from %s", char, infi)
             elif char == invalid_chars:
                 infi = infi.replace(char, "_")
-                logging.debug(f"Removed {char} from {infi}")
+                logging.debug("Removed %s from %s", char, infi)
+
+        logging.debug("Input file: %s", infi)
+        info.saveDir = infi + "_" + "nmap_results"
+        info.saveDirPorts = info.saveDir + "/open_ports"
 
-        logging.debug(f"Input file: {infi}")
-        HostInfo.saveDir = infi + "_" + "nmap_results"
-        HostInfo.saveDirPorts = HostInfo.saveDir + "/open_ports"
+    def save_all(info, flags) -> dict:
+        """
+        Runs the writers of flags.formats at the same time on a thread pool
+
+        The writers only read info so they don't depend on each other,
+        a writer that fails is logged and the others still finish
+
+        Returns:
+            dict: {writer: {"seconds": float, "cpu_seconds": float, "error": str or None}}
+        """
+        from concurrent.futures import ThreadPoolExecutor
 
-    def save_all() -> None:
+        writers = Files.select(flags.formats)
+        report = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(writers))) as pool:
+            results = pool.map(
+                lambda writer: Files.run_writer(writer, info, flags), writers
+            )
+            for writer, (seconds, cpu, error) in zip(writers, results):
+                report[writer.__name__] = {
+                    "seconds": seconds,
+                    "cpu_seconds": cpu,
+                    "error": error,
+                }
+                if error:
+                    logging.error("Error in %s: %s" % (writer.__name__, error))
+                else:
+                    logging.info(
+                        "%s finished in %.3f seconds" % (writer.__name__, seconds)
+                    )
+        return report
+
+    def register(name, writer=None):
+        """
+        Adds writer to the formats under name, a format that is already there
+        is replaced
+
+        writer is a function or a "module:function" string that is only
+        imported when the format is picked. Without a writer it returns a
+        decorator, @Automate.Files.register("name")
+        """
+        if writer is None:
+            return lambda writer: Files.register(name, writer) or writer
+        Files.exporters[name] = writer
+
+    def writer(name):
+        # Imports a "module:function" writer the first time it is used
+        writer = Files.exporters[name]
+        if isinstance(writer, str):
+            import importlib
+
+            module, _, function = writer.partition(":")
+            writer = getattr(importlib.import_module(module), function)
+            Files.exporters[name] = writer
+        return writer
+
+    def select(formats=None) -> list:
+        """
+        Returns the writers of formats, every format if it isn't given
+
+        Raises ValueError for a format that isn't registered or can't be imported
+        """
+        names = formats or list(Files.exporters)
+        unknown = [name for name in names if name not in Files.exporters]
+        if unknown:
+            raise ValueError(
+                "Unknown format %s, use one of %s"
+                % (", ".join(unknown), ", ".join(Files.exporters))
+            )
         try:
-            Files.save_ports_file()
-            Files.writehosts()
-            Files.save_results_file()
-            Files.save_json()
-            Files.save_csv()
-            Files.save_xml()
-            Files.save_html()
+            return [Files.writer(name) for name in dict.fromkeys(names)]
+        except (ImportError, AttributeError) as e:
+            raise ValueError("Could not load a writer (%s)" % e)
+
+    def load_plugins(plugins=()) -> None:
+        """
+        Imports every plugin module from --plugin and AUTOMATE_PLUGINS, each is
+        a module name or a path to a .py file
+        """
+        import importlib
+        import importlib.util
+
+        env = [p for p in os.environ.get(PLUGINENV, "").split(os.pathsep) if p]
+        for plugin in env + list(plugins):
+            try:
+                if plugin.endswith(".py"):
+                    name = os.path.splitext(os.path.basename(plugin))[0]
+                    spec = importlib.util.spec_from_file_location(name, plugin)
+                    module = importlib.util.module_from_spec(spec)
+                    sys.modules[name] = module
+                    spec.loader.exec_module(module)
+                else:
+                    importlib.import_module(plugin)
+            except Exception as e:
+                logging.critical("Could not load plugin %s (%s)" % (plugin, e))
+                sys.exit(1)
+            logging.info("Loaded plugin %s" % plugin)
+
+    def run_writer(writer, info, flags) -> tuple:
+        # Returns (seconds, cpu seconds, error) so one writer can't take down save_all
+        start, cpu = time.perf_counter(), time.thread_time()
+        error = None
+        try:
+            if Metrics.profiler:
+                Metrics.profile(writer, info, flags)
+            else:
+                writer(info, flags)
         except Exception as e:
-            logging.error(f"Error in save_all: {e}")
+            error = "%s: %s" % (type(e).__name__, e)
+        return time.perf_counter() - start, time.thread_time() - cpu, error
 
-    def find_input_file() -> None:
+    def find_input_file(info, flags) -> None:
         # look in current directory for a .gnmap
         files = [f for f in os.listdir(".") if os.path.isfile(f)]
         for f in files:
-            # If it ends with any of the SUPPORTEDFILES
-            if f.endswith(tuple(SUPPORTEDFILES)):
+            # If it ends with any of the SUPPORTEDFILES, compressed or not
+            if Stream.kind(f, sniff=False) in SUPPORTEDFILES:
                 print("No input provided found %s would you like to use?" % f)
                 try:
                     ans = input("Enter Y/N to continue:")[0].lower()
                 except IndexError:
                     ans = "y"
                 if ans == "y":
-                    HostInfo.inputFile = f
+                    info.inputFile = f
                     break
                 elif ans == "n":
                     continue
                 else:
                     print("Invalid input")
                     sys.exit(1)
-        if HostInfo.inputFile == "":
+        if info.inputFile == "":
             logging.critical("No input file provided or found, exiting")
             main.help_screen()
             sys.exit(1)
         else:
-            Files.set_save_dir()
-            logging.info("Using %s as input file" % HostInfo.inputFile)
-
-    def create_dir() -> None:
-        Files.set_save_dir()
-        if Flag.force:
-            Files.force_save()
-        logging.info("Creating %s directory" % HostInfo.saveDir)
+            Files.set_save_dir(info, flags)
+            logging.info("Using %s as input file" % info.inputFile)
+
+    def create_dir(info, flags) -> None:
+        Files.set_save_dir(info, flags)
+        if flags.force:
+            Files.force_save(info, flags)
+        logging.info("Creating %s directory" % info.saveDir)
         # elif: Check to see if the directory is empty
-        if not os.path.exists(HostInfo.saveDir):
-            os.makedirs(HostInfo.saveDir)
-        elif os.listdir(HostInfo.saveDir):
-            logging.critical("Directory %s is not empty" % HostInfo.saveDir)
+        # --follow updates the files of an earlier run in place
+        if not os.path.exists(info.saveDir):
+            os.makedirs(info.saveDir)
+        elif os.listdir(info.saveDir) and not flags.follow:
+            logging.critical("Directory %s is not empty" % info.saveDir)
             sys.exit(1)
-        if not os.path.exists(HostInfo.saveDirPorts):
-            os.makedirs(HostInfo.saveDirPorts)
-        elif os.listdir(HostInfo.saveDirPorts):
-            logging.critical("Directory %s is not empty" ^ HostInfo.saveDirPorts)
+        # --follow keeps the open_ports files up to date whatever the formats
+        if flags.diff or (
+            flags.formats and "ports" not in flags.formats and not flags.follow
+        ):
+            return
+        if not os.path.exists(info.saveDirPorts):
+            os.makedirs(info.saveDirPorts)
+        elif os.listdir(info.saveDirPorts) and not flags.follow:
+            logging.critical("Directory %s is not empty" % info.saveDirPorts)
             sys.exit(1)
 
     def clean_dir():
@@ -230,16 +768,18 @@ class Files:
             if not dir.endswith("_nmap_results") or not Files.confirm(dir):
                 continue
             Files.__deledir(dir)
+        Cache.clear()
         logging.info("Closing log file")
+        Log.stop()
         logging.shutdown()
         os.remove(LOGFILE)
         print("All files removed")
         sys.exit(0)
 
-    def force_save():
-        Files.set_save_dir()
-        Files.__deledir(HostInfo.saveDir)
-        logging.info("All Files removed from %s" % HostInfo.saveDir)
+    def force_save(info, flags):
+        Files.set_save_dir(info, flags)
+        Files.__deledir(info.saveDir)
+        logging.info("All Files removed from %s" % info.saveDir)
 
     def confirm(dir):
         print("This will remove all files from %s" % dir)
@@ -255,6 +795,13 @@ class Files:
             print("Invalid input")
             sys.exit(1)
 
+    def remove_file(file) -> None:
+        try:
+            if os.path.exists(file):
+                os.remove(file)
+        except OSError as e:
+            logging.warning(e)
+
     def __deledir(dir):
         logging.info("Trying to delete files")
         try:
@@ -265,10 +812,12 @@ class Files:
             logging.critical(e)
             sys.exit(1)
 
-    def save_results_file() -> None:
+    def save_results_file(info, flags=None, hosts=True) -> None:
+        # hosts=False leaves live_hosts.txt as it is (--follow appends to it)
+        write_hosts = hosts
         services, ports, all, hosts, tcp, udp = [], [], [], [], [], []
         logging.debug("Getting Sublists")
-        for allServ in HostInfo.all_service_list:
+        for allServ in info.all_service_list:
             services.append(allServ.get("service") + " " + allServ.get("version"))
             ports.append(allServ.get("port"))
             _all_lst = [
@@ -284,8 +833,9 @@ class Files:
                 tcp.append(allServ.get("port"))
             if "udp" in allServ.get("protocol"):
                 udp.append(allServ.get("port"))
-        for host in HostInfo.host_dict:
-            hosts.append(host)
+        if write_hosts:
+            for host in info.host_dict:
+                hosts.append(host)
 
         data = {
             "live_services": services,
@@ -298,26 +848,35 @@ class Files:
         files = []
         logging.debug("Saving Files")
         for ftype in data:
-            with open(HostInfo.saveDir + "/" + ftype + ".txt", "a") as f:
+            if ftype == "live_hosts" and not write_hosts:
+                continue
+            with open(info.saveDir + "/" + ftype + ".txt", "w") as f:
                 f.write("\n".join(data[ftype]))
                 files.append(ftype + ".txt")
 
         logging.debug("Files created: %s" % ", ".join(files))
 
-    def writehosts() -> None:
-        with open(HostInfo.saveDir + "/" + "HostInfo.txt", "a") as f:
+    def append_hosts(info, hosts) -> None:
+        # Adds hosts to the end of live_hosts.txt, which has no newline at the end
+        file = info.saveDir + "/" + "live_hosts.txt"
+        start = "\n" if os.path.exists(file) and os.path.getsize(file) else ""
+        with open(file, "a") as f:
+            f.write(start + "\n".join(hosts))
+
+    def writehosts(info, flags=None) -> None:
+        with open(info.saveDir + "/" + "HostInfo.txt", "w") as f:
 
             # get total number of hosts
-            f.write("#Total Hosts: %s\n" % len(HostInfo.host_dict))
-            f.write("#Total Services: %s\n" % len(HostInfo.all_service_list))
-            f.write("#Total TCP Services: %s\n" % HostInfo.numPors.get("tcp"))
-            f.write("#Total UDP Services: %s\n" % HostInfo.numPors.get("udp"))
+            f.write("#Total Hosts: %s\n" % len(info.host_dict))
+            f.write("#Total Services: %s\n" % len(info.all_service_list))
+            f.write("#Total TCP Services: %s\n" % info.numPors.get("tcp"))
+            f.write("#Total UDP Services: %s\n" % info.numPors.get("udp"))
 
             f.write("\n")
-            for host in HostInfo.host_dict:
+            for host in info.host_dict:
                 f.write("Host: " + host + "\n")
                 tempList = []
-                for all in HostInfo.host_dict[host]:
+                for all in info.host_dict[host]:
                     __temp = []
                     for port in all:
                         if all[port] == None:
@@ -329,143 +888,324 @@ class Files:
                 f.write("\n")
             logging.debug("Files created: %s" % "HostInfo.txt")
 
-    def save_ports_file() -> None:
-        logging.info("Creating files in " + HostInfo.saveDirPorts)
-        files = []
-        for service in HostInfo.all_service_list:
-            file = "%s_%s_%s_%s.txt" % (
-                service.get("port"),
-                service.get("state"),
-                service.get("protocol"),
-                service.get("service"),
-            )
-            files.append(file)
-            with open(HostInfo.saveDirPorts + "/" + file, "a") as f:
-                for host in HostInfo.host_dict:
-                    if service in HostInfo.host_dict[host]:
-                        f.write("%s\n" % host)
+    def save_ports_file(info, flags=None, keys=None) -> None:
+        """
+        Writes a file of hosts for each service from info.service_hosts
+
+        keys: only rewrite the files of these service keys, a file that no
+        longer has any hosts is removed (used by --follow)
+        """
+        logging.info("Creating files in " + info.saveDirPorts)
+        wanted = None if keys is None else {"%s_%s_%s_%s.txt" % key[:4] for key in keys}
+        # Services that only differ by version share the same file
+        files = {}
+        for key, hosts in info.service_hosts.items():
+            file = "%s_%s_%s_%s.txt" % key[:4]
+            if wanted is None or file in wanted:
+                files.setdefault(file, []).append(hosts)
+        for file in (wanted or set()) - files.keys():
+            Files.remove_file(info.saveDirPorts + "/" + file)
+        for file, lists in files.items():
+            # Each list is in address order, more than one is put back in order
+            hosts = lists[0]
+            if len(lists) > 1:
+                hosts = sorted(
+                    (host for part in lists for host in part), key=HostInfo.host_key
+                )
+            with open(info.saveDirPorts + "/" + file, "w") as f:
+                f.write("".join("%s\n" % host for host in hosts))
         logging.debug("Files created: %s" % ", ".join(files))
 
-    def save_json() -> None:
+    def save_cidr_file(info, flags=None) -> None:
+        """
+        Writes live_hosts_cidr.txt and a file for each service in
+        open_ports_cidr, named the same as in open_ports, with the hosts
+        collapsed into CIDR blocks (10.0.0.0/24 instead of 256 lines)
+        """
+        directory = info.saveDir + "/" + "open_ports_cidr"
+        os.makedirs(directory, exist_ok=True)
+        with open(info.saveDir + "/" + "live_hosts_cidr.txt", "w") as f:
+            f.write("".join("%s\n" % block for block in HostInfo.cidrs(info.host_dict)))
+        files = {}
+        for key, hosts in info.service_hosts.items():
+            files.setdefault("%s_%s_%s_%s.txt" % key[:4], []).extend(hosts)
+        for file, hosts in files.items():
+            with open(directory + "/" + file, "w") as f:
+                f.write("".join("%s\n" % block for block in HostInfo.cidrs(hosts)))
+        logging.debug("Files created: %s" % "live_hosts_cidr.txt, open_ports_cidr")
+
+    def save_json(info, flags) -> None:
+        """
+        Writes HostInfo.json one host at a time instead of dumping host_dict
+
+        The output is the same as json.dump(host_dict, indent=4), with
+        --compact-json it is written without any whitespace
+        """
         import json
 
-        with open(HostInfo.saveDir + "/" + "HostInfo.json", "w") as f:
-            json.dump(HostInfo.host_dict, f, indent=4)
+        with Stream.create(info.saveDir + "/" + "HostInfo.json", flags.compress) as f:
+            f.write("{")
+            for i, (host, ports) in enumerate(info.iter_hosts()):
+                if flags.compact_json:
+                    f.write("," if i else "")
+                    f.write(json.dumps(host) + ":")
+                    f.write(json.dumps(ports, separators=(",", ":"), default=dict))
+                    continue
+                # Drop the "{\n" and "\n}" around the host to nest it in the file
+                f.write(",\n" if i else "\n")
+                f.write(json.dumps({host: ports}, indent=4, default=dict)[2:-2])
+            f.write("\n}" if info.host_dict and not flags.compact_json else "}")
         logging.debug("Files created: %s" % "HostInfo.json")
 
-    def save_csv() -> None:
+    def save_jsonl(info, flags) -> None:
+        """
+        Writes HostInfo.jsonl, one {"host": ..., "ports": [...]} per line
+
+        Each line is a whole host so other tools can read the file while it
+        is still being written
+        """
+        import json
+
+        with Stream.create(info.saveDir + "/" + "HostInfo.jsonl", flags.compress) as f:
+            for host, ports in info.iter_hosts():
+                line = {"host": host, "ports": ports}
+                f.write(json.dumps(line, separators=(",", ":"), default=dict) + "\n")
+        logging.debug("Files created: %s" % "HostInfo.jsonl")
+
+    def save_csv(info, flags) -> None:
         import csv
+        import itertools
 
-        with open(HostInfo.saveDir + "/" + "HostInfo.csv", "w") as f:
+        rows = (
+            [
+                host,
+                service.get("port"),
+                service.get("protocol"),
+                # service["owner"],
+                service.get("service"),
+                # service["rpc_info"],
+                service.get("version"),
+            ]
+            for host, services in info.iter_hosts()
+            for service in services
+        )
+        with Stream.create(info.saveDir + "/" + "HostInfo.csv", flags.compress) as f:
             writer = csv.writer(f)
             writer.writerow(
                 ["Host", "Port", "Protocol", "Owner", "Service", "RPC Info", "Version"]
             )
-            for host in HostInfo.host_dict:
-                for service in HostInfo.host_dict[host]:
-                    writer.writerow(
-                        [
-                            host,
-                            service.get("port"),
-                            service.get("protocol"),
-                            # service["owner"],
-                            service.get("service"),
-                            # service["rpc_info"],
-                            service.get("version"),
-                        ]
-                    )
+            # Rows are written in batches, only one batch is held at a time
+            while True:
+                batch = list(itertools.islice(rows, CSVBATCH))
+                if not batch:
+                    break
+                writer.writerows(batch)
         logging.debug("Files created: %s" % "HostInfo.csv")
 
-    def save_xml() -> None:
-
-        import xml.etree.ElementTree as ET
-
-        root = ET.Element("HostInfo")
-        for host in HostInfo.host_dict:
-            hostElement = ET.SubElement(root, "Host")
-            hostElement.set("name", host)
-            for service in HostInfo.host_dict[host]:
-                serviceElement = ET.SubElement(hostElement, "Service")
-                serviceElement.set("port", service.get("port"))
-                serviceElement.set("protocol", service.get("protocol"))
-                serviceElement.set("state", service.get("state"))
-                serviceElement.set("service", service.get("service"))
-                serviceElement.set("version", service.get("version"))
-                # serviceElement.set("rpc_info", service["rpc_info"])
-                # serviceElement.set("owner", service["owner"])
-
-        from xml.dom import minidom
-
-        xmlstr = minidom.parseString(ET.tostring(root)).toprettyxml(indent="   ")
-        with open(HostInfo.saveDir + "/" + "HostInfo.xml", "w") as f:
-            f.write(xmlstr)
-        # tree.write(HostInfo.saveDir + "/" + "HostInfo.xml")
+    def save_xml(info, flags) -> None:
+        """
+        Writes HostInfo.xml while walking the hosts, nothing is built in memory
+
+        Same layout as the old ElementTree/minidom output:
+        <HostInfo><Host name=""><Service port="" protocol="" state=""
+        service="" version=""/></Host></HostInfo>
+        --xml-indent sets the spaces per level, 0 writes it on one line
+        """
+        from xml.sax.saxutils import escape
+
+        # Attribute values also need quotes and whitespace escaped
+        entities = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+        indent = " " * flags.xml_indent
+        newline = "\n" if flags.xml_indent else ""
+
+        def attr(value) -> str:
+            return escape("" if value is None else str(value), entities)
+
+        with Stream.create(info.saveDir + "/" + "HostInfo.xml", flags.compress) as f:
+            f.write('<?xml version="1.0" ?>' + newline)
+            if not info.host_dict:
+                f.write("<HostInfo/>" + newline)
+            else:
+                f.write("<HostInfo>" + newline)
+            for host, services in info.iter_hosts():
+                f.write('%s<Host name="%s"' % (indent, attr(host)))
+                if not services:
+                    f.write("/>" + newline)
+                    continue
+                f.write(">" + newline)
+                for service in services:
+                    f.write(
+                        '%s<Service port="%s" protocol="%s" state="%s" service="%s" version="%s"/>%s'
+                        % (
+                            indent * 2,
+                            attr(service.get("port")),
+                            attr(service.get("protocol")),
+                            attr(service.get("state")),
+                            attr(service.get("service")),
+                            attr(service.get("version")),
+                            newline,
+                        )
+                    )
+                f.write(indent + "</Host>" + newline)
+            if info.host_dict:
+                f.write("</HostInfo>" + newline)
         logging.debug("Files created: %s" % "HostInfo.xml")
 
-    def save_html() -> None:
-        head = """<!DOCTYPE html><html><head><meta name=viewport content="width=device-width, initial-scale=1"><style>h1{text-align:center;background:#161b22;font-size:50px;font-family:"Times New Roman",Times,serif;color:#ddd}body{background:#0d1117;font-family:'Roboto',sans-serif;overflow:scroll;overflow-x:hidden;text-align:center}.wrapper{width:45rem;margin-inline:auto}.example::-webkit-scrollbar{display:none}.collapsible{text-transform:uppercase;font-size:1.25em;font-weight:900;background:none,linear-gradient(45deg,#1030ff8e,#3794d269);background-size:400%;animation:bg-animation 20s infinite alternate;cursor:pointer;padding:18px;width:100%;text-align:center;outline:2px ridge rgba(0,0,0,.6);border-radius:2rem;font-size:15px}.active,.collapsible:hover{background:none,linear-gradient(45deg,#1030ff48,#1030ffa6);background-size:400%;animation:bg-animation 1s infinite alternate}.content{padding:0 18px;max-height:0;background:#161b22;overflow:hidden;text-align:justify;transition:max-height .2s ease-out;margin-inline:auto;width:90%}.collapsible,.content{margin-bottom:5px;color:white}.sub-content-container{display:grid;grid-auto-flow:column;grid-auto-columns:auto}.sub-content{padding:5px;font-size:15px}@keyframes bg-animation{0%{background-position:left}100%{background-position:right}}.github-corner{position:sticky;bottom:0;right:0;text-align:right}.gh{text-decoration:none;color:white;text-transform:uppercase}.gh:hover{text-decoration:none;color:yellow}.gh:focus{text-decoration:none;color:orange}.gh:active{text-decoration:none;color:teal}</style></head><body><h1><a class=gh href=https://github.com/timothy90990/Automate title=a>Automate Results</a></h1><div class=wrapper>
+    def save_sql3(info, flags=None) -> None:
         """
+        Saves hosts, services and ports to a SQLite database
 
-        close = """</div><script>var coll=document.getElementsByClassName("collapsible");var i;for(i=0;i<coll.length;i++){coll[i].addEventListener("click",function(){this.classList.toggle("active");var a=this.nextElementSibling;if(a.style.maxHeight){a.style.maxHeight=null}else{a.style.maxHeight=a.scrollHeight+"px"}})};</script></body></html>
+        Everything is written in one transaction with executemany batches and
+        the indexes are built once the rows are in. Query it with --query
         """
+        import itertools
+        import sqlite3
 
-        with open(HostInfo.saveDir + "/" + "Automate.html", "w") as f:
-            f.write(head)
-            for host in HostInfo.host_dict:
-                f.write(
-                    '<button type="button" class="collapsible">%s</button><div class="content">'
-                    % host
+        file = info.saveDir + "/" + "HostInfo.sqlite3"
+        Files.remove_file(file)
+        db = sqlite3.connect(file)
+        try:
+            # Nothing to recover if this fails part way, the file is rebuilt
+            db.execute("PRAGMA journal_mode = OFF")
+            db.execute("PRAGMA synchronous = OFF")
+            with db:
+                db.executescript(Query.SCHEMA)
+                host_ids = {host: i for i, host in enumerate(info.host_dict, 1)}
+                service_ids = {key: i for i, key in enumerate(info.service_registry, 1)}
+                db.executemany(
+                    "INSERT INTO hosts (id, host, address) VALUES (?, ?, ?)",
+                    (
+                        (i, host, HostInfo.host_key(host))
+                        for host, i in host_ids.items()
+                    ),
                 )
-                for service in HostInfo.host_dict[host]:
-                    f.write(
-                        """<div class="sub-content-container">
-                        <div class="sub-content"><strong>Port:</strong> %s</div>
-                        <div class="sub-content"><strong>Protocol:</strong> %s</div>
-                        <div class="sub-content"><strong>State:</strong> %s</div>
-                        <div class="sub-content"><strong>Service:</strong> %s</div>
-                        <div class="sub-content"><strong>Version:</strong> %s</div>
-                        </div>
-                        """
-                        % (
+                db.executemany(
+                    "INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        (i, Query.number(key[0])) + key[1:] + (info.service_count[key],)
+                        for key, i in service_ids.items()
+                    ),
+                )
+                rows = (
+                    (
+                        host_ids[host],
+                        service_ids.get(HostInfo.service_key(port)),
+                        Query.number(port.get("port")),
+                        port.get("state"),
+                        port.get("protocol"),
+                        port.get("owner"),
+                        port.get("service"),
+                        port.get("rpc_info"),
+                        port.get("version"),
+                    )
+                    for host in info.host_dict
+                    for port in info.host_dict[host]
+                )
+                while True:
+                    batch = list(itertools.islice(rows, Query.BATCH))
+                    if not batch:
+                        break
+                    db.executemany(
+                        "INSERT INTO ports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch
+                    )
+                db.executescript(Query.INDEXES)
+        finally:
+            db.close()
+        logging.debug("Files created: %s" % "HostInfo.sqlite3")
+
+    def save_html(info, flags) -> None:
+        """
+        Writes Automate.html, a report that renders only the rows in view
+
+        The results are written once as compact JSON (in the page, or in
+        Automate.data.js next to it with --html-sidecar) and the page builds
+        the rows that are scrolled into view from it, with search and port and
+        service filters. -o opens the report in the default browser
+        """
+        import json
+
+        head = """<!DOCTYPE html><html><head><meta charset=utf-8><meta name=viewport content="width=device-width, initial-scale=1"><style>h1{text-align:center;background:#161b22;font-size:50px;font-family:"Times New Roman",Times,serif;color:#ddd}body{background:#0d1117;font-family:'Roboto',sans-serif;overflow:hidden;text-align:center;color:white;margin:0}.wrapper{width:60rem;max-width:95%;margin-inline:auto}.filters{display:flex;gap:8px;margin-bottom:8px}.filters input,.filters select{flex:1;padding:8px;border-radius:2rem;border:2px ridge rgba(0,0,0,.6);background:#161b22;color:white;font-size:15px}.count{margin-bottom:5px;color:#ddd;font-size:13px}.view{position:relative;height:calc(100vh - 230px);overflow-y:auto;background:#161b22;border-radius:1rem}.row,.header{display:grid;grid-template-columns:2fr 1fr 1fr 1fr 2fr 4fr;height:28px;line-height:28px;font-size:15px;text-align:left;padding:0 18px;white-space:nowrap}.row{position:absolute;left:0;right:0}.row div,.header div{overflow:hidden;text-overflow:ellipsis;padding-right:8px}.header{font-weight:900;text-transform:uppercase;background:none,linear-gradient(45deg,#1030ff8e,#3794d269);border-radius:2rem;margin-bottom:5px}.row:nth-child(even){background:#1b2230}.row:hover{background:#1030ff48}.gh{text-decoration:none;color:white;text-transform:uppercase}.gh:hover{text-decoration:none;color:yellow}.gh:focus{text-decoration:none;color:orange}.gh:active{text-decoration:none;color:teal}</style></head><body><h1><a class=gh href=https://github.com/timothy90990/Automate title=a>Automate Results</a></h1><div class=wrapper><div class=filters><input id=search placeholder="Search hosts, services, versions"><input id=port placeholder=Port><select id=service><option value="">All services</option></select></div><div class=count id=count></div><div class=header><div>Host</div><div>Port</div><div>Protocol</div><div>State</div><div>Service</div><div>Version</div></div><div class=view id=view><div id=spacer></div></div></div>
+        """
+
+        close = """<script>var H=28,D=window.AUTOMATE_DATA,R=[],S=[],V=[],hosts=D.hosts.length,view=document.getElementById("view"),spacer=document.getElementById("spacer"),search=document.getElementById("search"),port=document.getElementById("port"),service=document.getElementById("service"),count=document.getElementById("count"),seen={};D.hosts.forEach(function(h){if(!h[1].length){R.push([h[0],"","","","No Service Found",""])}h[1].forEach(function(p){R.push([h[0]].concat(p));seen[p[3]]=1})});R.forEach(function(r){S.push(r.join(" ").toLowerCase())});Object.keys(seen).sort().forEach(function(s){var o=document.createElement("option");o.value=o.textContent=s;service.appendChild(o)});function esc(s){return String(s).replace(/[&<>"]/g,function(c){return{"&":"&amp;","<":"&lt;",">":"&gt;",'"':"&quot;"}[c]})}function filter(){var q=search.value.trim().toLowerCase(),p=port.value.trim(),s=service.value;V=[];for(var i=0;i<R.length;i++){if(p&&R[i][1]!==p)continue;if(s&&R[i][4]!==s)continue;if(q&&S[i].indexOf(q)<0)continue;V.push(i)}spacer.style.height=V.length*H+"px";count.textContent=V.length+" of "+R.length+" ports on "+hosts+" hosts";view.scrollTop=0;render()}function render(){var first=Math.max(0,Math.floor(view.scrollTop/H)-10),last=Math.min(V.length,first+Math.ceil(view.clientHeight/H)+20),html="";for(var i=first;i<last;i++){var r=R[V[i]];html+='<div class=row style="top:'+i*H+'px"><div>'+esc(r[0])+"</div><div>"+esc(r[1])+"</div><div>"+esc(r[2])+"</div><div>"+esc(r[3])+"</div><div>"+esc(r[4])+'</div><div title="'+esc(r[5])+'">'+esc(r[5])+"</div></div>"}spacer.innerHTML=html}var timer;function later(){clearTimeout(timer);timer=setTimeout(filter,150)}search.addEventListener("input",later);port.addEventListener("input",later);service.addEventListener("change",filter);view.addEventListener("scroll",function(){window.requestAnimationFrame(render)});window.addEventListener("resize",render);filter();</script></body></html>
+        """
+
+        if flags.html_sidecar:
+            data = open(
+                info.saveDir + "/" + "Automate.data.js", "w", buffering=BUFFERSIZE
+            )
+        else:
+            data = None
+        with open(info.saveDir + "/" + "Automate.html", "w", buffering=BUFFERSIZE) as f:
+            f.write(head)
+            if data:
+                f.write('<script src="Automate.data.js"></script>')
+            out = data or f
+            if not data:
+                out.write("<script>")
+            # {"hosts": [[host, [[port, protocol, state, service, version], ...]], ...]}
+            out.write('window.AUTOMATE_DATA={"hosts":[')
+            for i, (host, services) in enumerate(info.iter_hosts()):
+                row = [
+                    host,
+                    [
+                        [
                             service.get("port"),
                             service.get("protocol"),
                             service.get("state"),
                             service.get("service"),
                             service.get("version"),
-                        )
-                    )
-                    # When there are no more services beak
-                    if service == HostInfo.host_dict[host][-1]:
-                        break
-                else:
-                    f.write(
-                        """<div class="sub-content"><strong>No Service Found</strong></div>"""
-                    )
-                f.write("</div>")
+                        ]
+                        for service in services
+                    ],
+                ]
+                # Versions come from the scanned host, a "<" could close the
+                # <script> tag the data is in or start a "<!--" inside it
+                text = json.dumps(row, separators=(",", ":")).replace("<", "\\u003c")
+                out.write(("," if i else "") + text)
+            out.write("]};")
+            if data:
+                data.close()
+            else:
+                out.write("</script>")
             f.write(close)
+        logging.debug("Files created: %s" % "Automate.html")
 
+        if not flags.open_browser:
+            return
         # Open the file in the default browser
         import webbrowser
 
         new = 2
-        file = "file://" + os.path.realpath(HostInfo.saveDir + "/" + "Automate.html")
+        file = "file://" + os.path.realpath(info.saveDir + "/" + "Automate.html")
         webbrowser.open(file, new=new)
 
 
+# Built in formats, plugins add theirs with Files.register
+Files.register("ports", Files.save_ports_file)
+Files.register("txt", Files.writehosts)
+Files.register("live", Files.save_results_file)
+Files.register("cidr", Files.save_cidr_file)
+Files.register("json", Files.save_json)
+Files.register("jsonl", Files.save_jsonl)
+Files.register("csv", Files.save_csv)
+Files.register("xml", Files.save_xml)
+Files.register("html", Files.save_html)
+Files.register("sqlite", Files.save_sql3)
+# Run as a script this module is __main__, plugins import it as Automate
+sys.modules.setdefault("Automate", sys.modules[__name__])
+
+
 # ------------------------------------------------------------------------------
 # Nmap Parser Class
 # ------------------------------------------------------------------------------
 class NmapParse:
-    def nmap_parser() -> None:
-        with open(HostInfo.inputFile) as f:
-            data = f.read()
+    def nmap_parser(info, flags) -> None:
         try:
-            if HostInfo.inputFile.endswith(".xml"):
-                NmapParse.xml.parse(data)
-            if HostInfo.inputFile.endswith(".gnmap"):
-                NmapParse.gnmap.parse(data)
-            if HostInfo.inputFile.endswith(".nmap"):
-                NmapParse.nmap.parse(data)
+            if len(info.inputFiles) > 1:
+                NmapParse.parse_many(info, info.inputFiles, flags.jobs)
+            else:
+                NmapParse.parse_input(info, flags.jobs)
         except NotImplementedError as e:
             logging.critical("NotImplementedError - Nmap Parser - (%s)" % e)
             sys.exit(1)
@@ -473,60 +1213,454 @@ class NmapParse:
             logging.critical("Parsing file exiting (%s)" % e)
             sys.exit(1)
 
+    def parse_input(info, jobs=None) -> None:
+        kind = Stream.kind(info.inputFile)
+        if kind == "xml":
+            # iterparse reads the (decompressed) file one chunk at a time
+            with Stream.open(info.inputFile, "rb") as f:
+                NmapParse.xml.parse(info, f)
+        if kind == "gnmap" and Stream.compression(info.inputFile):
+            # Stream the lines straight from the decompressed file handle
+            with Stream.open(info.inputFile) as f:
+                NmapParse.gnmap.parse(info, f)
+        elif kind == "gnmap":
+            NmapParse.gnmap.parse_mmap(info, info.inputFile, jobs)
+        if kind == "nmap":
+            NmapParse.nmap.parse(info, info.inputFile)
+
+    def parse_many(info, files, jobs=None) -> None:
+        """
+        Parses every file in its own worker process and merges the results
+
+        A host found in more than one file keeps the ports of all of them,
+        when the same port/protocol is in two files the file that comes
+        later in sorted order wins
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        files = sorted(files)
+        workers = min(len(files), jobs or os.cpu_count() or 1)
+        logging.info("Parsing %s files with %s workers" % (len(files), workers))
+        merged = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for file, (host_dict, lines) in zip(
+                files, pool.map(NmapParse.parse_file, files)
+            ):
+                info.numLines += lines
+                logging.info("Merging %s hosts from %s" % (len(host_dict), file))
+                for host, ports in host_dict.items():
+                    if host not in merged:
+                        merged[host] = ports
+                        continue
+                    by_port = {
+                        (p.get("port"), p.get("protocol")): p for p in merged[host]
+                    }
+                    for port in ports:
+                        by_port[(port.get("port"), port.get("protocol"))] = port
+                    merged[host] = list(by_port.values())
+        for host in merged:
+            info.update_host(update={host: merged[host]})
+        info.sort_hosts()
+
+    def parse_file(file) -> dict:
+        """
+        Runs in a worker process, parses one file and returns its host_dict
+        and the number of lines read
+
+        The worker gets its own HostInfo so nothing leaks between files
+        """
+        Log.worker()
+        info = HostInfo()
+        info.inputFile = file
+        # Already one process per file, don't split the file again
+        NmapParse.parse_input(info, jobs=1)
+        return info.host_dict, info.numLines
+
     class nmap:
-        def parse(file) -> None:
+        def parse(info, file) -> None:
             raise NotImplementedError(
                 "NMAP FILE TYPE NOT SUPPORTED ON VERSION %s" % VERSION
             )
-            logging.info("Parsing NMAP file %s" % HostInfo.inputFile)
+            logging.info("Parsing NMAP file %s" % info.inputFile)
 
     class xml:
-        def parse(data) -> dict:
+        def parse(info, source) -> dict:
             """
-            Takes in an XML file from Nmap and parses it into a dictionary
+            Takes in an XML file from Nmap and parses it into info
 
             Returns:
                 dict: Dictionary of hosts and services
                 dict{host: [service, service, service], host: [service, service, service]}
             """
+            logging.info("Parsing XML file %s" % info.inputFile)
+            temp_dict = {}
+            for ip, ports in NmapParse.xml.records(source):
+                temp_dict[ip] = ports
+                info.update_host(update={ip: ports})
+            info.sort_hosts()
+            return temp_dict
+
+        def records(source):
+            """
+            Pass in a path or an open file and yield (ip, ports) for each live host
+
+            The file is read with iterparse, each <host> is yielded as soon as
+            it is closed and then cleared so only one host is held in memory
+            """
             import xml.etree.ElementTree as ET
 
-            logging.info("Parsing XML file %s" % HostInfo.inputFile)
-            temp_dict = {}
-            root = ET.fromstring(data)
-            host_data = root.findall("host")
-            for x in host_data:
-                ip = x.find("address").get("addr")
-                temp_dict[ip] = []
-                ports = x.findall("ports/port")
-                for port in ports:
-                    temp_dict[ip].append(
-                        {
-                            "port": port.get("portid"),
-                            "state": port.find("state").get("state"),
-                            "protocol": port.get("protocol"),
-                            "service": port.find("service").get("name"),
-                            "version": port.find("service").get("product"),
-                        }
-                    )
-                    for key in temp_dict[ip][-1]:
-                        if temp_dict[ip][-1][key] is None:
-                            temp_dict[ip][-1][key] = ""
+            context = iter(ET.iterparse(source, events=("start", "end")))
+            # The first start event is the <nmaprun> root
+            _, root = next(context)
+            for event, elem in context:
+                if event != "end" or elem.tag != "host":
+                    continue
+                ip, ports = NmapParse.xml.parsehost(elem)
+                if ip is not None:
+                    yield ip, ports
+                # Free the host and anything before it that root is holding on to
+                elem.clear()
+                root.clear()
+
+        def parsehost(host) -> tuple:
+            """
+            Pass in a <host> element and return (ip, ports)
 
-            HostInfo.update_host(update=temp_dict)
-            return temp_dict
+            The ip is the first address that is not a mac address, it is None
+            when the host has no such address or its <status> is not up
+            Ports without a <state> or <service> child get "" for those fields
+            """
+            status = host.find("status")
+            if status is not None and status.get("state") != "up":
+                return None, []
+            ip = None
+            for address in host.findall("address"):
+                if address.get("addrtype") != "mac":
+                    ip = address.get("addr")
+                    break
+            ports = []
+            for port in host.findall("ports/port"):
+                state = port.find("state")
+                service = port.find("service")
+                ports.append(
+                    Port(
+                        port=port.get("portid") or "",
+                        state="" if state is None else state.get("state") or "",
+                        protocol=port.get("protocol") or "",
+                        service="" if service is None else service.get("name") or "",
+                        version="" if service is None else service.get("product") or "",
+                    )
+                )
+            return ip, ports
 
     class gnmap:
-        def parse(data) -> None:
+        # Host: <ip> (<hostname>)\t<field>: <value>\t<field>: <value>
+        # An IPv4 or IPv6 address, IPv6 can have a zone (fe80::1%eth0)
+        HOST_REGEX = re.compile(
+            r"^Host: (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|[0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:%[\w.-]+)?)\s"
+        )
+        # port/state/protocol/owner/service/rpc_info/version/
+        PORT_REGEX = re.compile(
+            r"(\d+)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/"
+        )
+        # The same two for parse_mmap, which scans the file as bytes. The
+        # whitespace after the ip is the one HOST_REGEX takes, short of a newline
+        HOST_BYTES = re.compile(
+            rb"^Host: (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}|[0-9A-Fa-f]*:[0-9A-Fa-f:.]*(?:%[\w.-]+)?)"
+            rb"(?:[ \t\r\f\v]|(?=\n))([^\n]*)",
+            re.M,
+        )
+        PORT_BYTES = re.compile(
+            rb"(\d+)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/([^/]*)/"
+        )
+
+        def parse(info, data) -> None:
             # ($port, $state, $protocol, $owner, $service, $rpc_info, $version)
             logging.info("Parsing GNMAP file ")
-            # All of the hosts
-            hosts = NmapParse.gnmap.findhosts(data)
-            # All of the live hosts
-            for host in hosts:
-                if NmapParse.gnmap.hoststatus(host, data):
-                    ports = NmapParse.gnmap.hostports(host, data)
-                    HostInfo.update_host(update={host: ports})
+            # data is the file contents or an open file, an open file is read
+            # one line at a time so only the current line is held in memory
+            lines = data.splitlines() if isinstance(data, str) else data
+            for host, ports in NmapParse.gnmap.records(lines, info=info):
+                info.update_host(update={host: ports})
+            info.sort_hosts()
+
+        def parse_mmap(info, file, jobs=None) -> None:
+            """
+            Parses a plain .gnmap through a memory map instead of line by line
+
+            The map is scanned as bytes and only the fields that are kept are
+            decoded. A file over SCANCHUNK is split at host boundaries and the
+            parts are scanned by worker processes that each map the same file,
+            so nothing is copied to them
+            """
+            import mmap
+
+            logging.info("Parsing GNMAP file %s" % file)
+            if not os.path.getsize(file):
+                return
+            with open(file, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    workers = min(jobs or os.cpu_count() or 1, len(view) // SCANCHUNK)
+                    chunks = NmapParse.gnmap.split(view, max(workers, 1))
+                    if len(chunks) == 1:
+                        # Each host goes into info as it is scanned, nothing
+                        # is collected first
+                        records = NmapParse.gnmap.scan(view, 0, len(view))
+                        for host, ports in NmapParse.gnmap.group(records):
+                            info.update_host(update={host: [Port(*p) for p in ports]})
+                        info.numLines += NmapParse.gnmap.count_lines(view, 0, len(view))
+            if len(chunks) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+
+                logging.info("Scanning %s in %s parts" % (file, len(chunks)))
+                # Log.worker runs in each child, the parent keeps its queue
+                with ProcessPoolExecutor(
+                    max_workers=len(chunks), initializer=Log.worker
+                ) as pool:
+                    # The parts are merged in file order as each one comes back,
+                    # the same as one pass would
+                    for hosts, lines in pool.map(
+                        NmapParse.gnmap.scan_chunk,
+                        [(file, start, end) for start, end in chunks],
+                    ):
+                        info.numLines += lines
+                        for host, ports in hosts:
+                            info.update_host(update={host: [Port(*p) for p in ports]})
+            info.sort_hosts()
+
+        def scan_chunk(args) -> tuple:
+            """
+            Pass in (file, start, end) and scan those bytes of the file
+
+            Runs in a worker process for a large file, the pool sets up its
+            logging. The ports are plain tuples, they pickle faster than Port
+            objects
+
+            Returns:
+                tuple: ([(host, [port tuple, ...]), ...], lines read)
+            """
+            import mmap
+
+            file, start, end = args
+            with open(file, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    hosts = list(
+                        NmapParse.gnmap.group(NmapParse.gnmap.scan(view, start, end))
+                    )
+                    lines = NmapParse.gnmap.count_lines(view, start, end)
+            return hosts, lines
+
+        def count_lines(view, start, end) -> int:
+            # Counted a slice at a time so the whole part isn't copied
+            lines = 0
+            for pos in range(start, end, SCANCHUNK):
+                lines += view[pos : min(pos + SCANCHUNK, end)].count(b"\n")
+            if end > start and view[end - 1] != ord("\n"):
+                lines += 1
+            return lines
+
+        def scan(view, start, end):
+            """
+            Pass in a bytes-like (an mmap) and yield (host, status, ports) for
+            each Host line between start and end, the same as parse_line
+
+            Ports are (port, state, protocol, owner, service, rpc_info, version)
+            tuples. They repeat across hosts, so each distinct one is decoded once
+            """
+            decoded = {}
+            for match in NmapParse.gnmap.HOST_BYTES.finditer(view, start, end):
+                status, ports = None, None
+                for field in match.group(2).split(b"\t"):
+                    if field.startswith(b"Status: "):
+                        status = field[8:].strip().decode(errors="replace")
+                    elif field.startswith(b"Ports: "):
+                        ports = []
+                        for port in NmapParse.gnmap.PORT_BYTES.findall(field, 7):
+                            fields = decoded.get(port)
+                            if fields is None:
+                                fields = decoded[port] = tuple(
+                                    sys.intern(f.decode(errors="replace")) for f in port
+                                )
+                            ports.append(fields)
+                yield match.group(1).decode(), status, ports
+
+        def split(view, parts) -> list:
+            """
+            Pass in a bytes-like and return up to parts (start, end) ranges
+
+            Each range ends on a line boundary and the lines of one host stay
+            in one range, so the ranges can be scanned on their own
+            """
+            size, bounds = len(view), [0]
+            host = NmapParse.gnmap.HOST_BYTES
+            for i in range(1, parts):
+                pos = view.find(b"\n", max(size * i // parts, bounds[-1]))
+                if pos == -1:
+                    break
+                pos += 1
+                # Move past the lines that are for the host of the line before
+                before = host.match(view, view.rfind(b"\n", 0, pos - 1) + 1)
+                while before and pos < size:
+                    after = host.match(view, pos)
+                    if not after or after.group(1) != before.group(1):
+                        break
+                    pos = view.find(b"\n", pos) + 1 or size
+                if bounds[-1] < pos < size:
+                    bounds.append(pos)
+            bounds.append(size)
+            return list(zip(bounds, bounds[1:]))
+
+        def update(info, lines) -> tuple:
+            """
+            Pass in lines added to a file that nmap is still writing
+
+            Returns:
+                tuple: (hosts that were updated, service keys whose hosts changed,
+                hosts seen for the first time)
+            """
+            hosts, changed, added = 0, set(), []
+            for host, ports in NmapParse.gnmap.records(
+                lines, live=info.host_dict, info=info
+            ):
+                if host not in info.host_dict:
+                    added.append(host)
+                before = {HostInfo.service_key(p) for p in info.host_dict.get(host, [])}
+                info.update_host(update={host: ports})
+                changed |= before ^ {HostInfo.service_key(p) for p in ports}
+                hosts += 1
+            return hosts, changed, added
+
+        def follow(info, flags) -> None:
+            """
+            Tails a .gnmap while nmap is still writing it
+
+            Only the bytes added since the last read are parsed. After each read
+            only what changed is written: the open_ports files of the services
+            whose hosts changed, the live_* service lists when a service comes
+            or goes and the new hosts appended to live_hosts.txt. HostInfo.txt
+            starts with totals so it is rewritten whole, at most every
+            FOLLOWSUMMARY seconds. The other exporters, and all of these in
+            order, run once nmap is done (or on Ctrl-C)
+            """
+            logging.info("Following GNMAP file %s" % info.inputFile)
+            first, partial, done = True, b"", False
+            summary = 0.0
+            with open(info.inputFile, "rb") as f:
+                while not done:
+                    if os.path.getsize(info.inputFile) < f.tell():
+                        logging.warning(
+                            "%s was truncated, reading it again" % info.inputFile
+                        )
+                        f.seek(0)
+                        partial = b""
+                    chunk = f.read()
+                    if not chunk:
+                        time.sleep(FOLLOWINTERVAL)
+                        continue
+                    # A line that nmap hasn't finished is kept for the next read
+                    lines = (partial + chunk).split(b"\n")
+                    partial = lines.pop()
+                    lines = [line.decode(errors="replace") for line in lines]
+                    done = any(line.startswith("# Nmap done") for line in lines)
+                    services = set(info.service_registry)
+                    hosts, changed, added = NmapParse.gnmap.update(info, lines)
+                    if first:
+                        # Files of an earlier run may be for services that are gone
+                        for file in os.listdir(info.saveDirPorts):
+                            Files.remove_file(info.saveDirPorts + "/" + file)
+                        Files.save_ports_file(info)
+                        Files.save_results_file(info)
+                    else:
+                        if changed:
+                            Files.save_ports_file(info, keys=changed)
+                        if services != info.service_registry.keys():
+                            Files.save_results_file(info, hosts=False)
+                        if added:
+                            Files.append_hosts(info, added)
+                    if first or (hosts and time.monotonic() - summary >= FOLLOWSUMMARY):
+                        Files.writehosts(info)
+                        summary = time.monotonic()
+                    if hosts:
+                        logging.info(
+                            "%s hosts updated, %s services changed"
+                            % (hosts, len(changed))
+                        )
+                    first = False
+
+        def records(lines, live=(), info=None):
+            """
+            Pass in an iterable of lines and yield (host, ports) for each live host
+
+            Each line is read once. Nmap writes the Status and Ports lines of a
+            host next to each other, so a host is yielded as soon as a line for
+            a different host shows up (or the lines run out)
+
+            live: hosts already known to be up, their Ports line is yielded
+            even when its Status line was in an earlier read (--follow)
+            info: the lines read are added to its numLines
+            """
+            read = 0
+
+            def parsed():
+                nonlocal read
+                for read, line in enumerate(lines, 1):
+                    yield NmapParse.gnmap.parse_line(line)
+
+            yield from NmapParse.gnmap.group(parsed(), live)
+            if info is not None:
+                info.numLines += read
+
+        def group(records, live=()):
+            """
+            Pass in (host, status, ports) records, None for a line that isn't
+            a Host line, and yield (host, ports) for each live host
+
+            Nmap writes the Status and Ports lines of a host next to each other,
+            so a host is yielded as soon as a record for a different host shows up
+            """
+            current, status, ports = None, None, None
+            for record in records:
+                if record is None:
+                    continue
+                host, line_status, line_ports = record
+                if host != current:
+                    if status == "Up" or (
+                        status is None and ports is not None and current in live
+                    ):
+                        yield current, ports or []
+                    current, status, ports = host, None, None
+                if line_status is not None and status != "Up":
+                    status = line_status
+                if line_ports is not None and ports is None:
+                    ports = line_ports
+            if status == "Up" or (
+                status is None and ports is not None and current in live
+            ):
+                yield current, ports or []
+
+        def parse_line(line) -> tuple:
+            """
+            Pass in a single line and return (host, status, ports)
+
+            Host: <host> (<wildcard>)	Status: Up
+            Host: <host> (<wildcard>)	Ports: port/state/protocol/owner/service/rpc_info/version/, ...
+            status or ports is None when the line does not have that field
+            return None if the line is not a Host line
+            """
+            match = NmapParse.gnmap.HOST_REGEX.match(line)
+            if not match:
+                return None
+            status, ports = None, None
+            for field in line[match.end() :].split("\t"):
+                if field.startswith("Status: "):
+                    status = field[8:].strip()
+                elif field.startswith("Ports: "):
+                    # (port, state, protocol, owner, service, rpc_info, version)
+                    ports = [
+                        Port(*port)
+                        for port in NmapParse.gnmap.PORT_REGEX.findall(field, 7)
+                    ]
+            return match.group(1), status, ports
 
         def findhosts(file_contents) -> list:
             """
@@ -536,14 +1670,12 @@ class NmapParse:
             as long as it follows this format
             Host: <ip> <hostname>
             """
-            import re
-
-            regex = re.compile(r"Host: (\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})")
-            hosts = []
+            hosts = set()
             for line in file_contents.splitlines():
-                if regex.search(line):
-                    hosts.append(regex.search(line).group(1))
-            return sorted(list(set(hosts)))
+                record = NmapParse.gnmap.parse_line(line)
+                if record:
+                    hosts.add(record[0])
+            return sorted(hosts, key=HostInfo.host_key)
 
         def hoststatus(host, file_contents) -> bool:
             """
@@ -553,13 +1685,10 @@ class NmapParse:
             return True if up
             return False if down
             """
-            import re
-
-            regex = re.compile(r"Host: %s.*Status: (\w+)" % host)
             for line in file_contents.splitlines():
-                if regex.search(line):
-                    if regex.search(line).group(1) == "Up":
-                        return True
+                record = NmapParse.gnmap.parse_line(line)
+                if record and record[0] == host and record[1] == "Up":
+                    return True
             return False
 
         def hostports(host, file_contents) -> list:
@@ -572,36 +1701,864 @@ class NmapParse:
             Then find all of the ports that follow this format
             port/state/protocol/owner/service/rpc_info/version/
             """
-            import re
-
-            regex = re.compile(r"Host: %s.*Ports: (\w+)" % host)
-            line_ports = ""
-            dict_port = {}
-            list_ports = []
             for line in file_contents.splitlines():
-                if regex.search(line):
-                    # Remove the regex match from the line
-                    line_ports = line.replace(regex.search(line).group(0), "")
-                    break
-            # print("%s ---> %s" % (host, line_ports))
-            # If the line_ports is empty then there are no ports open
-            if not line_ports:
-                return list_ports
-            # Get the ports from the line /port/state/protocol/owner/service/rpc_info/version/
-            regex = re.compile(r"(\d+)/(\w*)/(\w*)/(\w*)/(\w*)/(\w*)/(\w*)/")
-            ports = regex.findall(line_ports)
-            for port in ports:
-                dict_port = {
-                    "port": port[0],
-                    "state": port[1],
-                    "protocol": port[2],
-                    "owner": port[3],
-                    "service": port[4],
-                    "rpc_info": port[5],
-                    "version": port[6],
-                }
-                list_ports.append(dict_port)
-            return list_ports
+                record = NmapParse.gnmap.parse_line(line)
+                if record and record[0] == host and record[2] is not None:
+                    return record[2]
+            return []
+
+
+# ------------------------------------------------------------------------------
+# Cache Class
+# ------------------------------------------------------------------------------
+class Cache:
+    """
+    Cache Class, a binary snapshot of the parsed results for each input
+        load: Loads a HostInfo from the snapshot if the input has not changed
+        save: Saves a HostInfo to a snapshot
+        read: Loads a HostInfo from a snapshot file
+        fingerprint: Path, size, mtime and content hash of an input file
+        evict: Removes the oldest snapshots until the cache fits in CACHESIZE
+        clear: Removes every snapshot (-c)
+
+    CACHEDIR is only readable by the user, the snapshots hold the full scan
+    results outside of the results directory
+
+    Ports are stored as plain tuples, a pickled Port names the module it came
+    from, which is __main__ when the script wrote it and Automate when a
+    library caller reads it
+    """
+
+    # Bump when the snapshot layout changes so old snapshots are ignored
+    FORMAT = 4
+    FIELDS = [
+        "host_dict",
+        "all_service_list",
+        "service_registry",
+        "service_count",
+        "service_hosts",
+        "field_index",
+        "numPors",
+    ]
+
+    def path(info) -> str:
+        import hashlib
+
+        inputs = info.inputFiles or [info.inputFile]
+        name = "\0".join(sorted(os.path.abspath(f) for f in inputs))
+        return os.path.join(
+            CACHEDIR, hashlib.sha256(name.encode()).hexdigest() + ".cache"
+        )
+
+    def fingerprint(file) -> dict:
+        import hashlib
+
+        stat = os.stat(file)
+        digest = hashlib.blake2b()
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return {
+            "path": os.path.abspath(file),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": digest.hexdigest(),
+        }
+
+    def read(info, cache) -> None:
+        """
+        Loads info from a snapshot file without checking it against an input
+
+        Raises ValueError for a snapshot in a format this version can't read
+        """
+        import pickle
+
+        with open(cache, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot.get("format") != Cache.FORMAT:
+            raise ValueError("%s is not a snapshot this version can read" % cache)
+        Cache.restore(info, snapshot)
+        info.inputFile = snapshot["inputs"][0]["path"]
+        logging.info("Loaded %s hosts from %s" % (len(info.host_dict), cache))
+
+    def load(info) -> bool:
+        import pickle
+
+        inputs = sorted(info.inputFiles or [info.inputFile])
+        info.fingerprints = None
+        cache = Cache.path(info)
+        if not os.path.isfile(cache):
+            logging.info("No cached results for %s" % ", ".join(inputs))
+            return False
+        try:
+            with open(cache, "rb") as f:
+                snapshot = pickle.load(f)
+            stale = (
+                snapshot.get("format") != Cache.FORMAT
+                or snapshot.get("version") != VERSION
+            )
+            # Size and mtime are checked first so a changed file isn't hashed
+            for file, saved in zip(inputs, snapshot.get("inputs", [])):
+                stat = os.stat(file)
+                if (stat.st_size, stat.st_mtime_ns) != (saved["size"], saved["mtime"]):
+                    stale = True
+            if not stale:
+                info.fingerprints = [Cache.fingerprint(f) for f in inputs]
+                stale = info.fingerprints != snapshot.get("inputs")
+        except Exception as e:
+            logging.warning("Could not read cache %s (%s)" % (cache, e))
+            stale = True
+        if stale:
+            logging.info("Cached results for %s are out of date" % ", ".join(inputs))
+            Files.remove_file(cache)
+            return False
+        Cache.restore(info, snapshot)
+        # Mark it as used for the eviction order
+        os.utime(cache)
+        logging.info("Loaded %s hosts from cache %s" % (len(info.host_dict), cache))
+        return True
+
+    def restore(info, snapshot) -> None:
+        for field in Cache.FIELDS:
+            setattr(info, field, snapshot[field])
+        info.host_dict = {
+            host: [Port(*port) for port in ports]
+            for host, ports in snapshot["host_dict"].items()
+        }
+
+    def save(info) -> None:
+        import operator
+        import pickle
+
+        inputs = sorted(info.inputFiles or [info.inputFile])
+        cache = Cache.path(info)
+        try:
+            snapshot = {
+                "format": Cache.FORMAT,
+                "version": VERSION,
+                "inputs": info.fingerprints or [Cache.fingerprint(f) for f in inputs],
+            }
+            for field in Cache.FIELDS:
+                snapshot[field] = getattr(info, field)
+            fields = operator.attrgetter(*Port.__slots__)
+            snapshot["host_dict"] = {
+                host: [fields(port) for port in ports]
+                for host, ports in info.host_dict.items()
+            }
+            os.makedirs(CACHEDIR, mode=0o700, exist_ok=True)
+            # makedirs leaves the mode of a directory an older version made
+            os.chmod(CACHEDIR, 0o700)
+            # Write to a temp file first so a half written snapshot is never loaded
+            fd = os.open(cache + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache + ".tmp", cache)
+            logging.info("Saved parsed results to cache %s" % cache)
+        except Exception as e:
+            logging.warning("Could not write cache %s (%s)" % (cache, e))
+            Files.remove_file(cache + ".tmp")
+            return
+        Cache.evict()
+
+    def evict() -> None:
+        snapshots = []
+        for name in os.listdir(CACHEDIR):
+            file = os.path.join(CACHEDIR, name)
+            if not name.endswith(".cache") or not os.path.isfile(file):
+                continue
+            try:
+                stat = os.stat(file)
+            except OSError:
+                # Removed by another worker (-b) since it was listed
+                continue
+            snapshots.append((stat.st_mtime, stat.st_size, file))
+        total = sum(size for _, size, _ in snapshots)
+        # Oldest first, the snapshot that was just written is kept
+        for _, size, file in sorted(snapshots)[:-1]:
+            if total <= CACHESIZE:
+                break
+            logging.info("Evicting cache %s" % file)
+            Files.remove_file(file)
+            total -= size
+
+    def clear() -> None:
+        if not os.path.isdir(CACHEDIR) or not Files.confirm(CACHEDIR):
+            return
+        for name in os.listdir(CACHEDIR):
+            if name.endswith((".cache", ".tmp")):
+                Files.remove_file(os.path.join(CACHEDIR, name))
+        logging.info("Cached results removed from %s" % CACHEDIR)
+
+
+# ------------------------------------------------------------------------------
+# Metrics Class
+# ------------------------------------------------------------------------------
+class Metrics:
+    """
+    Metrics Class, records how long each phase of a run takes
+        phase: Context manager that records the phase run inside it
+        record: Adds a phase that was timed somewhere else (writers)
+        summary: Table of the phases
+        save: Writes Automate.metrics.json and Automate.metrics.txt to the results
+        start_profile/stop_profile: cProfile the run (--profile) to Automate.prof
+
+    Every phase has its wall time, CPU time, the peak RSS of the process so
+    far and the number of hosts, ports and lines at the end of the phase
+    """
+
+    phases = []
+    profiler = None
+    # Profiles of the writer threads, cProfile only sees the thread it runs in
+    profiles = []
+
+    @contextlib.contextmanager
+    def phase(name, info):
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            Metrics.record(
+                name, info, time.perf_counter() - start, time.process_time() - cpu
+            )
+
+    def record(name, info, seconds, cpu_seconds=None, **extra) -> None:
+        phase = {
+            "phase": name,
+            "seconds": round(seconds, 4),
+            "cpu_seconds": None if cpu_seconds is None else round(cpu_seconds, 4),
+            "peak_rss_mb": Metrics.peak_rss(),
+            "hosts": len(info.host_dict),
+            "ports": sum(len(ports) for ports in info.host_dict.values()),
+            "lines": info.numLines,
+        }
+        phase.update(extra)
+        Metrics.phases.append(phase)
+        # One record per phase stands in for the per item records of --trace
+        logging.info(
+            "%s: %.3f seconds, %s hosts, %s ports, %s lines",
+            name,
+            seconds,
+            phase["hosts"],
+            phase["ports"],
+            phase["lines"],
+        )
+
+    def peak_rss():
+        # resource is not on Windows
+        try:
+            import resource
+        except ImportError:
+            return None
+        rss = max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+        return round(rss / (1024**2 if sys.platform == "darwin" else 1024), 1)
+
+    def summary() -> str:
+        lines = [
+            "%-28s %10s %10s %14s %9s %9s %10s"
+            % (
+                "Phase",
+                "Wall (s)",
+                "CPU (s)",
+                "Peak RSS (MB)",
+                "Hosts",
+                "Ports",
+                "Lines",
+            )
+        ]
+        for phase in Metrics.phases:
+            lines.append(
+                "%-28s %10.3f %10s %14s %9s %9s %10s"
+                % (
+                    phase["phase"] + (" (failed)" if phase.get("error") else ""),
+                    phase["seconds"],
+                    (
+                        "-"
+                        if phase["cpu_seconds"] is None
+                        else "%.3f" % phase["cpu_seconds"]
+                    ),
+                    "-" if phase["peak_rss_mb"] is None else phase["peak_rss_mb"],
+                    phase["hosts"],
+                    phase["ports"],
+                    phase["lines"],
+                )
+            )
+        return "\n".join(lines)
+
+    def save(info) -> None:
+        import json
+
+        metrics = {
+            "version": VERSION,
+            "input": info.inputFiles or [info.inputFile],
+            "phases": Metrics.phases,
+        }
+        with open(info.saveDir + "/" + "Automate.metrics.json", "w") as f:
+            json.dump(metrics, f, indent=4)
+        with open(info.saveDir + "/" + "Automate.metrics.txt", "w") as f:
+            f.write(Metrics.summary() + "\n")
+        logging.debug(
+            "Files created: %s" % "Automate.metrics.json, Automate.metrics.txt"
+        )
+
+    def start_profile() -> None:
+        import cProfile
+
+        Metrics.profiler = cProfile.Profile()
+        Metrics.profiler.enable()
+
+    def profile(func, *args) -> None:
+        import cProfile
+
+        # From 3.12 cProfile is built on sys.monitoring, the run profiler already
+        # sees every thread and a second one can't be enabled while it is on
+        if sys.version_info >= (3, 12):
+            func(*args)
+            return
+        profiler = cProfile.Profile()
+        Metrics.profiles.append(profiler)
+        profiler.runcall(func, *args)
+
+    def stop_profile(info) -> None:
+        import pstats
+
+        Metrics.profiler.disable()
+        stats = pstats.Stats(Metrics.profiler)
+        for profiler in Metrics.profiles:
+            stats.add(profiler)
+        stats.dump_stats(info.saveDir + "/" + "Automate.prof")
+        logging.info("cProfile saved to %s/Automate.prof" % info.saveDir)
+
+
+# ------------------------------------------------------------------------------
+# Query Class
+# ------------------------------------------------------------------------------
+class Query:
+    """
+    Query Class, finds hosts by their ports without parsing again
+        parse: Turns filters like port=445 proto=tcp service~http into conditions
+        sql3: Runs the conditions against a HostInfo.sqlite3 from save_sql3
+        index: Runs the conditions against info.field_index (--filter)
+        match: Checks the conditions against one port
+
+    field=value matches exactly, field~value matches part of the value
+    (ignores case), every condition has to match on the same port.
+    host=value takes a CIDR, a range or one address and is looked up by
+    packed address, host~value matches part of the name
+    """
+
+    # Filter name: column in the ports table, host is in the hosts table
+    FIELDS = {
+        "host": "host",
+        "ip": "host",
+        "port": "port",
+        "state": "state",
+        "proto": "protocol",
+        "protocol": "protocol",
+        "owner": "owner",
+        "service": "service",
+        "rpc": "rpc_info",
+        "rpc_info": "rpc_info",
+        "version": "version",
+    }
+    BATCH = 10000  # Rows per executemany
+    SCHEMA = """
+        CREATE TABLE hosts (
+            id INTEGER PRIMARY KEY, host TEXT NOT NULL, address BLOB NOT NULL
+        );
+        CREATE TABLE services (
+            id INTEGER PRIMARY KEY, port INTEGER, state TEXT, protocol TEXT,
+            service TEXT, version TEXT, hosts INTEGER
+        );
+        CREATE TABLE ports (
+            host_id INTEGER REFERENCES hosts (id),
+            service_id INTEGER REFERENCES services (id),
+            port INTEGER, state TEXT, protocol TEXT, owner TEXT,
+            service TEXT, rpc_info TEXT, version TEXT
+        );
+    """
+    INDEXES = """
+        CREATE UNIQUE INDEX hosts_host ON hosts (host);
+        CREATE INDEX hosts_address ON hosts (address);
+        CREATE INDEX ports_port ON ports (port, protocol);
+        CREATE INDEX ports_service ON ports (service);
+        CREATE INDEX ports_protocol ON ports (protocol);
+        CREATE INDEX ports_host ON ports (host_id);
+    """
+
+    def number(port):
+        # Ports are stored as numbers so port=80 doesn't match 8080
+        return int(port) if port and port.isdigit() else port
+
+    def parse(filters) -> list:
+        """
+        Pass in a list of filters and return [(field, operator, value)]
+
+        Raises ValueError for a filter that isn't field=value or field~value
+        """
+        conditions = []
+        for text in filters:
+            match = re.match(r"^(\w+)\s*([=~])\s*(.*)$", text.strip())
+            if not match or match.group(1).lower() not in Query.FIELDS:
+                raise ValueError(
+                    "Invalid filter %s, use field=value or field~value with one of %s"
+                    % (text, ", ".join(Query.FIELDS))
+                )
+            field = Query.FIELDS[match.group(1).lower()]
+            if field == "host" and match.group(2) == "=":
+                try:
+                    HostInfo.address_range(match.group(3))
+                except ValueError as e:
+                    raise ValueError("Invalid filter %s (%s)" % (text, e))
+            conditions.append((field, match.group(2), match.group(3)))
+        return conditions
+
+    def sql3(database, conditions):
+        """
+        Pass in a HostInfo.sqlite3 path and conditions and yield the matching hosts
+        """
+        import sqlite3
+
+        where, params, join = [], [], False
+        for field, operator, value in conditions:
+            column = "h.host" if field == "host" else "p." + field
+            join = join or field != "host"
+            if operator == "~":
+                where.append("%s LIKE ? ESCAPE '\\'" % column)
+                escaped = value.replace("\\", "\\\\").replace("%", "\\%")
+                params.append("%" + escaped.replace("_", "\\_") + "%")
+            elif field == "host":
+                # Packed addresses compare in address order, a range is a BETWEEN
+                where.append("h.address BETWEEN ? AND ?")
+                params.extend(HostInfo.address_range(value))
+            else:
+                where.append("%s = ?" % column)
+                params.append(Query.number(value) if field == "port" else value)
+        query = "SELECT DISTINCT h.host, h.id FROM hosts h"
+        if join:
+            query += " JOIN ports p ON p.host_id = h.id"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY h.id"
+        db = sqlite3.connect("file:%s?mode=ro" % database, uri=True)
+        try:
+            for host, _ in db.execute(query, params):
+                yield host
+        finally:
+            db.close()
+
+    def index(info, conditions):
+        """
+        Pass in a HostInfo and conditions and yield its matching hosts in order
+
+        Conditions on the fields of a service key are answered from
+        info.field_index, the keys that pass all of them are services that
+        match on the same port. owner and rpc_info aren't in the key so they are
+        checked on the ports of the hosts that are left. host= is a binary
+        search of info.hosts_in, the service_hosts lists are only used to
+        check the hosts in that range
+        """
+        keys, rest, names, within = None, [], [], None
+        for field, operator, value in conditions:
+            if field == "host" and operator == "=":
+                found = info.hosts_in(value)
+                if within is not None:
+                    found = set(found)
+                    found = [host for host in within if host in found]
+                within = found
+                continue
+            if field == "host":
+                names.append((field, operator, value))
+                continue
+            if field not in HostInfo.INDEXED:
+                rest.append((field, operator, value))
+                continue
+            values = info.field_index[field]
+            if operator == "=":
+                found = values.get(value, {})
+            else:
+                found = {}
+                for text in values:
+                    if text is not None and value.lower() in str(text).lower():
+                        found.update(values[text])
+            keys = found.keys() if keys is None else keys & found.keys()
+        if keys is None:
+            hosts = info.host_dict if within is None else within
+        elif len(keys) == 1 and within is None:
+            # The hosts of a service are already in order
+            hosts = info.service_hosts[next(iter(keys))]
+        else:
+            matched = set()
+            for key in keys:
+                matched.update(info.service_hosts[key])
+            hosts = info.host_dict if within is None else within
+            hosts = (host for host in hosts if host in matched)
+        for host in hosts:
+            if names and not Query.match({"host": host}, names):
+                continue
+            if rest and not any(
+                Query.match(port, rest) for port in info.host_dict[host]
+            ):
+                continue
+            yield host
+
+    def match(port, conditions) -> bool:
+        for field, operator, value in conditions:
+            text = port.get(field)
+            if operator == "=":
+                if text != value:
+                    return False
+            elif text is None or value.lower() not in str(text).lower():
+                return False
+        return True
+
+
+# ------------------------------------------------------------------------------
+# Diff Class
+# ------------------------------------------------------------------------------
+class Diff:
+    """
+    Diff Class, works out what changed between two scans of the same ranges
+        load: Parses an input, or reads its cached results, into its own HostInfo
+        ports: {host: {(port, protocol): (state, service, version)}} of a HostInfo
+        compare: New and gone hosts, opened and closed ports and changed services
+        save: Writes Automate.diff.json and Automate.diff.txt to the results
+
+    Hosts and ports are compared as dict keys with set operations, so the
+    diff is linear in the size of the two scans
+    """
+
+    def load(file, cache=True):
+        """
+        Pass in a .gnmap, .xml or a snapshot from the cache and return its HostInfo
+        """
+        if not file.endswith(".cache"):
+            return parse(file, cache=cache)
+        info = HostInfo()
+        Cache.read(info, file)
+        return info
+
+    def ports(info) -> dict:
+        import operator
+
+        # Port is slotted, attrgetter reads it without going through Port.get
+        key = operator.attrgetter("port", "protocol")
+        value = operator.attrgetter("state", "service", "version")
+        return {
+            host: {key(port): value(port) for port in ports}
+            for host, ports in info.host_dict.items()
+        }
+
+    def port(host, key, value) -> dict:
+        return {
+            "host": host,
+            "port": key[0],
+            "protocol": key[1],
+            "state": value[0],
+            "service": value[1],
+            "version": value[2],
+        }
+
+    def compare(old, new) -> dict:
+        """
+        Pass in the HostInfo of the old and the new scan and return the changes
+        """
+        before, after = Diff.ports(old), Diff.ports(new)
+        diff = {
+            "old": old.inputFile,
+            "new": new.inputFile,
+            "new_hosts": [],
+            "hosts_gone": [],
+            "opened": [],
+            "closed": [],
+            "changed": [],
+            "services_added": [],
+            "services_removed": [],
+        }
+        for name, hosts, ports in (
+            ("new_hosts", after.keys() - before.keys(), after),
+            ("hosts_gone", before.keys() - after.keys(), before),
+        ):
+            for host in sorted(hosts, key=HostInfo.host_key):
+                diff[name].append(
+                    {
+                        "host": host,
+                        "ports": [
+                            Diff.port(host, key, value)
+                            for key, value in ports[host].items()
+                        ],
+                    }
+                )
+        for host in sorted(before.keys() & after.keys(), key=HostInfo.host_key):
+            old_ports, new_ports = before[host], after[host]
+            if old_ports == new_ports:
+                continue
+            for key in sorted(new_ports.keys() - old_ports.keys(), key=Diff.order):
+                diff["opened"].append(Diff.port(host, key, new_ports[key]))
+            for key in sorted(old_ports.keys() - new_ports.keys(), key=Diff.order):
+                diff["closed"].append(Diff.port(host, key, old_ports[key]))
+            for key in sorted(old_ports.keys() & new_ports.keys(), key=Diff.order):
+                if old_ports[key] != new_ports[key]:
+                    change = Diff.port(host, key, new_ports[key])
+                    change["before"] = dict(
+                        zip(["state", "service", "version"], old_ports[key])
+                    )
+                    diff["changed"].append(change)
+        # The service registries are keyed the same way, so these are set operations too
+        for name, first, second in (
+            ("services_added", new, old),
+            ("services_removed", old, new),
+        ):
+            for key in sorted(
+                first.service_count.keys() - second.service_count.keys(),
+                key=lambda key: (Diff.order((key[0], key[2])), key),
+            ):
+                service = dict(first.service_registry[key])
+                service["hosts"] = first.service_count[key]
+                diff[name].append(service)
+        diff["summary"] = {
+            name: len(diff[name]) for name in diff if name not in ["old", "new"]
+        }
+        return diff
+
+    def order(key):
+        # (port, protocol) in port number order
+        return (int(key[0]) if key[0].isdigit() else 0, key[0], key[1])
+
+    def text(diff):
+        """
+        Yields the lines of the text report
+        """
+
+        def describe(port):
+            return " ".join(
+                str(port[field]) for field in ["service", "version"] if port.get(field)
+            )
+
+        yield "Changes from %s to %s" % (diff["old"], diff["new"])
+        for name, count in diff["summary"].items():
+            yield "    %-18s %s" % (name.replace("_", " "), count)
+        for name, sign in [("new_hosts", "+"), ("hosts_gone", "-")]:
+            yield ""
+            yield name.replace("_", " ").capitalize()
+            for host in diff[name]:
+                yield "%s %s" % (sign, host["host"])
+                for port in host["ports"]:
+                    yield "    %s/%s %s" % (
+                        port["port"],
+                        port["protocol"],
+                        describe(port),
+                    )
+        for name, sign in [("opened", "+"), ("closed", "-")]:
+            yield ""
+            yield "Ports %s" % name
+            for port in diff[name]:
+                yield "%s %s %s/%s %s" % (
+                    sign,
+                    port["host"],
+                    port["port"],
+                    port["protocol"],
+                    describe(port),
+                )
+        yield ""
+        yield "Services changed"
+        for port in diff["changed"]:
+            before = port["before"]
+            yield "~ %s %s/%s %s %s -> %s %s" % (
+                port["host"],
+                port["port"],
+                port["protocol"],
+                before["state"],
+                describe(before),
+                port["state"],
+                describe(port),
+            )
+        for name, sign in [("services_added", "+"), ("services_removed", "-")]:
+            yield ""
+            yield name.replace("_", " ").capitalize()
+            for service in diff[name]:
+                yield "%s %s/%s %s (%s hosts)" % (
+                    sign,
+                    service["port"],
+                    service["protocol"],
+                    describe(service),
+                    service["hosts"],
+                )
+
+    def save(info, diff) -> None:
+        import json
+
+        with open(info.saveDir + "/" + "Automate.diff.json", "w") as f:
+            json.dump(diff, f, indent=4)
+        with open(info.saveDir + "/" + "Automate.diff.txt", "w") as f:
+            for line in Diff.text(diff):
+                f.write(line + "\n")
+        logging.debug("Files created: %s" % "Automate.diff.json, Automate.diff.txt")
+
+
+# ------------------------------------------------------------------------------
+# Batch Class
+# ------------------------------------------------------------------------------
+class Batch:
+    """
+    Batch Class, parses every scan under a directory without any prompts
+        find: The scan files under a directory and the results directory of each
+        current: Whether the results of a scan are up to date
+        run_file: Parses one scan into its results directory
+        run: Runs run_file on every scan, jobs at a time
+        summary: Table of the status and time of each scan
+
+    Each scan gets its own <name>_nmap_results next to it. A results
+    directory written by batch has an Automate.batch.json stamp of the
+    input it was made from. A scan whose stamp still matches is skipped, and
+    a directory without a stamp is left alone unless -f is given
+    """
+
+    STAMP = "Automate.batch.json"
+
+    def find(root) -> list:
+        """
+        Pass in a directory and return [(scan, results directory), ...]
+
+        Results directories are not walked into. Two scans with the same
+        name in one directory (scan.gnmap and scan.xml) keep their suffix in
+        the name of their results
+        """
+        found = []
+        for dir, dirs, files in os.walk(root):
+            dirs[:] = sorted(d for d in dirs if not d.endswith("_nmap_results"))
+            scans = [
+                f
+                for f in sorted(files)
+                if Stream.kind(os.path.join(dir, f)) in SUPPORTEDFILES
+            ]
+            names = [os.path.splitext(Stream.strip(f))[0] for f in scans]
+            for scan, name in zip(scans, names):
+                if names.count(name) > 1:
+                    name = Stream.strip(scan).replace(".", "_")
+                found.append(
+                    (os.path.join(dir, scan), os.path.join(dir, name + "_nmap_results"))
+                )
+        return found
+
+    def stamp(file, flags) -> dict:
+        stat = os.stat(file)
+        return {
+            "input": os.path.abspath(file),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "version": VERSION,
+            "formats": flags.formats,
+            "compress": flags.compress,
+        }
+
+    def current(file, directory, flags) -> bool:
+        import json
+
+        try:
+            with open(os.path.join(directory, Batch.STAMP)) as f:
+                return json.load(f) == Batch.stamp(file, flags)
+        except (OSError, ValueError):
+            return False
+
+    def run_file(args) -> dict:
+        """
+        Pass in (scan, results directory, flags), runs in a worker process
+
+        Nothing is raised or exits, a scan that fails is reported as failed
+
+        Returns:
+            dict: {"file", "directory", "status", "seconds", "hosts", "error"}
+        """
+        import json
+
+        file, directory, flags = args
+        Log.worker()
+        start = time.perf_counter()
+        result = {"file": file, "directory": directory, "hosts": None, "error": None}
+        if not flags.force and Batch.current(file, directory, flags):
+            result.update(status="up to date", seconds=0.0)
+            return result
+        if os.path.isdir(directory) and os.listdir(directory):
+            if not flags.force and not os.path.isfile(
+                os.path.join(directory, Batch.STAMP)
+            ):
+                result.update(status="exists", seconds=0.0)
+                return result
+            shutil.rmtree(directory)
+        # Phases are kept on the class, a worker reused for another scan
+        # starts over
+        Metrics.phases = []
+        try:
+            cpu = time.process_time()
+            info = parse(file, jobs=1, cache=flags.cache)
+            Metrics.record(
+                "parse", info, time.perf_counter() - start, time.process_time() - cpu
+            )
+            with Metrics.phase("save_all", info):
+                report = export(info, directory, flags=flags)
+            Metrics.save(info)
+            errors = [
+                "%s: %s" % (w, r["error"]) for w, r in report.items() if r["error"]
+            ]
+            if errors:
+                raise RuntimeError(", ".join(errors))
+            with open(os.path.join(directory, Batch.STAMP), "w") as f:
+                json.dump(Batch.stamp(file, flags), f, indent=4)
+            result.update(status="done", hosts=len(info.host_dict))
+        except Exception as e:
+            logging.error("Batch %s failed (%s)" % (file, e))
+            # Half written results would be taken for someone else's next time
+            shutil.rmtree(directory, ignore_errors=True)
+            result.update(status="failed", error="%s: %s" % (type(e).__name__, e))
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run(root, flags) -> list:
+        """
+        Runs every scan under root, flags.jobs scans at a time (CPU cores
+        by default), and returns the result of each in the order found
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        scans = Batch.find(root)
+        if not scans:
+            return []
+        workers = min(len(scans), flags.jobs or os.cpu_count() or 1)
+        logging.info("Batch of %s scans with %s workers" % (len(scans), workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(
+                pool.map(
+                    Batch.run_file,
+                    [(file, directory, flags) for file, directory in scans],
+                )
+            )
+
+    def summary(results) -> str:
+        lines = ["%-10s %10s %9s  %s" % ("Status", "Wall (s)", "Hosts", "Scan")]
+        for result in results:
+            lines.append(
+                "%-10s %10.3f %9s  %s"
+                % (
+                    result["status"],
+                    result["seconds"],
+                    "" if result["hosts"] is None else result["hosts"],
+                    result["file"],
+                )
+            )
+            if result["error"]:
+                lines.append("%-10s %10s %9s  %s" % ("", "", "", result["error"]))
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        lines.append(
+            "%s scans: %s"
+            % (len(results), ", ".join("%s %s" % (n, s) for s, n in counts.items()))
+        )
+        return "\n".join(lines)
 
 
 # ------------------------------------------------------------------------------
@@ -610,18 +2567,60 @@ class NmapParse:
 class Flag:
     """
     -h  --help                        Displays the help screen
-    -i  -iL  --input  --input-list    Input file from nmap scanner (.gnmap)
+    -i  -iL  --input  --input-list    Input file(s) from nmap scanner (.gnmap, .xml), can be
+                                      compressed with gzip, xz or bz2 (scan.gnmap.gz)
+                                      More than one file or a glob ("scans/*.gnmap") is
+                                      parsed in parallel and merged into one directory
                                       Default: looks for .gnmap in current directory
+    -j  --jobs <n>                    Number of worker processes for more than one input or
+                                      for the parts of a .gnmap over 32 MB
+                                      Default: number of CPU cores
     -f  --force                       Force the program to run by deleteing nmap_results folder
                                       Default: Exit if the directory already exists
     -c  --clean                       Clean the results directory by deleteing nmap_results folder
+                                      and the cached results in ~/.cache/automate
                                       Default: Just parse the file
+    -q  --query <db> <filter>...      Print the hosts in a HostInfo.sqlite3 that match the filters
+                                      Filters: port= state= proto= service= version= (= exact,
+                                      ~ part of the value) e.g. port=445 proto=tcp service~smb
+                                      host= takes a CIDR or range, e.g. host=10.0.0.0/16
+    -d  --diff <old> <new>            Compare two scans (.gnmap, .xml or cached .cache) and write
+                                      the new and gone hosts, opened and closed ports and
+                                      changed services to Automate.diff.json and .txt
+    -b  --batch <dir>                 Parse every .gnmap/.xml under dir into its own results
+                                      directory with no prompts, -j at a time, skipping scans
+                                      whose results are up to date, -f redoes them all
+    --filter <filter>...              Print the hosts in the input that match the filters instead
+                                      of writing the results, same filters as --query
+    --formats <name,name>             Only write these formats, one of ports (open_ports), txt
+                                      (HostInfo.txt), live (live_*.txt), cidr (open_ports_cidr and
+                                      live_hosts_cidr.txt), json, jsonl, csv, xml, html,
+                                      sqlite or a format added by a plugin
+                                      Default: every format
+    --plugin <module>                 Load a module or .py file that registers more formats, also
+                                      read from AUTOMATE_PLUGINS (split by os.pathsep)
     -n                                Silent Mode doesnt display header
+    --profile                         Print the time taken by each phase and save a cProfile
+                                      of the run to Automate.prof in the results directory
+    --compress <gz|xz|bz2>            Compress HostInfo.json, .jsonl, .csv and .xml, the suffix
+                                      is added to the name (HostInfo.json.gz)
+    --compact-json                    Write HostInfo.json without indentation or spaces
+    --xml-indent <n>                  Spaces per level in HostInfo.xml, 0 writes it on one line
+                                      Default: 3
+    -o  --open                        Open Automate.html in the default browser when done
+    --html-sidecar                    Keep the Automate.html data in Automate.data.js next to it
+    --follow                          Keep reading a .gnmap that nmap is still writing and update
+                                      the results as hosts come in, stops when nmap is done
+    --no-cache                        Always parse the input instead of loading the cached results
+                                      Default: reuse the results cached for an unchanged input
     -v                                Verbose output
     -vv --verbose                     Extra Verbose output
+    --trace                           Log every host and port as it is parsed to Automate.log
     """
 
-    def __init__(self, argv=sys.argv):
+    def __init__(self, argv=None):
+        # argv[0] is the program, Flag([]) gives the defaults
+        self.argv = sys.argv if argv is None else argv
         self.header = True
         self.help = False
         self.scanner = False
@@ -629,6 +2628,22 @@ class Flag:
         self.verbose = False
         self.clean = False
         self.inputFlag = False
+        self.inputFiles = []
+        self.jobs = None
+        self.cache = True
+        self.follow = False
+        self.compact_json = False
+        self.profile = False
+        self.xml_indent = 3
+        self.open_browser = False
+        self.html_sidecar = False
+        self.query = None  # [database, filter, filter, ...]
+        self.diff = None  # [old, new]
+        self.batch = None  # Directory of scans
+        self.filter = None  # [filter, filter, ...]
+        self.formats = None  # [name, name, ...] or None for every format
+        self.compress = None  # "gz", "xz", "bz2" or None for plain files
+        self.plugins = []
         self.get_user_args()
 
     def get_user_args(self):
@@ -647,11 +2662,34 @@ class Flag:
             "-v",
             "-vv",
             "--verbose",
+            "--trace",
+            "-j",
+            "--jobs",
+            "--no-cache",
+            "--follow",
+            "--compact-json",
+            "--profile",
+            "--xml-indent",
+            "-o",
+            "--open",
+            "--html-sidecar",
+            "-q",
+            "--query",
+            "-d",
+            "--diff",
+            "-b",
+            "--batch",
+            "--filter",
+            "--formats",
+            "--plugin",
+            "--compress",
         ]
         inputList = ["-i", "-iL", "--input", "--input-list"]
+        # Arguments that belong to a flag
+        values = set()
         # Get the user arguments
-        for i, arg in enumerate(sys.argv):
-            if i == 0:
+        for i, arg in enumerate(self.argv):
+            if i == 0 or i in values:
                 continue
             # Check to see if "-" is the first character
             if arg[0] == "-" and arg in avaliableFlags:
@@ -659,29 +2697,41 @@ class Flag:
                 if arg in ["-h", "--help"]:
                     self.help = True
                     break
-                elif arg in ["-i", "-iL", "--input", "--input-list"]:
+                elif arg in inputList:
                     logging.debug("Input file flag found")
-                    if self.inputFlag:
-                        logging.error("Only one input file can be used")
-                        self.help = True
-                        break
-                    if (i + 1 >= len(sys.argv)) or sys.argv[i + 1] in avaliableFlags:
+                    # Every argument up to the next flag is an input file or glob
+                    files = []
+                    for j in range(i + 1, len(self.argv)):
+                        if self.argv[j] in avaliableFlags:
+                            break
+                        values.add(j)
+                        files += sorted(glob.glob(self.argv[j])) or [self.argv[j]]
+                    if not files:
                         logging.error("No input file specified after %s" % arg)
                         self.help = True
                         break
-                    elif not os.path.isfile(sys.argv[i + 1]):
+                    missing = [f for f in files if not os.path.isfile(f)]
+                    if missing:
                         logging.error(
-                            "File %s does not exist" % sys.argv[i + 1]
+                            "File %s does not exist" % ", ".join(missing)
                             + "\n"
                             + "Please enter a valid file or leave blank to use the default\n"
                             + ".gnmap file in the current directory\n"
                         )
                         self.help = True
                         break
-                    else:
-                        self.inputFlag = True
-                        logging.debug("Input file: %s" % sys.argv[i + 1])
-                        HostInfo.inputFile = sys.argv[i + 1]
+                    self.inputFlag = True
+                    logging.debug("Input file: %s" % ", ".join(files))
+                    for f in files:
+                        if f not in self.inputFiles:
+                            self.inputFiles.append(f)
+                elif arg in ["-j", "--jobs"]:
+                    if i + 1 >= len(self.argv) or not self.argv[i + 1].isdigit():
+                        logging.error("No number of jobs specified after %s" % arg)
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.jobs = max(1, int(self.argv[i + 1]))
                 elif arg in ["-f", "--force"]:
                     self.force = True
                 elif arg in ["-c", "--clean"]:
@@ -691,35 +2741,335 @@ class Flag:
                 elif arg in ["-v"]:
                     consoleHandler.setLevel(logging.INFO)
                 elif arg in ["-vv", "--verbose"]:
+                    logging.getLogger().setLevel(logging.DEBUG)
                     consoleHandler.setLevel(logging.DEBUG)
-            elif self.inputFlag and sys.argv[i - 1] in inputList:
-                continue
+                elif arg in ["--trace"]:
+                    Log.set_trace()
+                elif arg in ["--no-cache"]:
+                    self.cache = False
+                elif arg in ["--follow"]:
+                    self.follow = True
+                elif arg in ["--compact-json"]:
+                    self.compact_json = True
+                elif arg in ["--profile"]:
+                    self.profile = True
+                elif arg in ["-o", "--open"]:
+                    self.open_browser = True
+                elif arg in ["--html-sidecar"]:
+                    self.html_sidecar = True
+                elif arg in ["--xml-indent"]:
+                    if i + 1 >= len(self.argv) or not self.argv[i + 1].isdigit():
+                        logging.error("No number of spaces specified after %s" % arg)
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.xml_indent = int(self.argv[i + 1])
+                elif arg in ["-q", "--query"]:
+                    # The database and then every filter up to the next flag
+                    self.query = []
+                    for j in range(i + 1, len(self.argv)):
+                        if self.argv[j] in avaliableFlags:
+                            break
+                        values.add(j)
+                        self.query.append(self.argv[j])
+                    if not self.query or not os.path.isfile(self.query[0]):
+                        logging.error("No database found after %s" % arg)
+                        self.help = True
+                        break
+                elif arg in ["--formats"]:
+                    if i + 1 >= len(self.argv) or self.argv[i + 1] in avaliableFlags:
+                        logging.error("No formats specified after %s" % arg)
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.formats = [f for f in self.argv[i + 1].split(",") if f]
+                elif arg in ["--compress"]:
+                    if i + 1 >= len(self.argv) or self.argv[i + 1] not in COMPRESSIONS:
+                        logging.error(
+                            "No compression (%s) specified after %s"
+                            % (", ".join(COMPRESSIONS), arg)
+                        )
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.compress = self.argv[i + 1]
+                elif arg in ["--plugin"]:
+                    if i + 1 >= len(self.argv) or self.argv[i + 1] in avaliableFlags:
+                        logging.error("No plugin specified after %s" % arg)
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.plugins.append(self.argv[i + 1])
+                elif arg in ["--filter"]:
+                    # Every filter up to the next flag
+                    self.filter = []
+                    for j in range(i + 1, len(self.argv)):
+                        if self.argv[j] in avaliableFlags:
+                            break
+                        values.add(j)
+                        self.filter.append(self.argv[j])
+                    if not self.filter:
+                        logging.error("No filters found after %s" % arg)
+                        self.help = True
+                        break
+                elif arg in ["-d", "--diff"]:
+                    self.diff = self.argv[i + 1 : i + 3]
+                    values.update([i + 1, i + 2])
+                    if len(self.diff) != 2 or not all(
+                        os.path.isfile(f) for f in self.diff
+                    ):
+                        logging.error("Two scan files are needed after %s" % arg)
+                        self.help = True
+                        break
+                elif arg in ["-b", "--batch"]:
+                    if i + 1 >= len(self.argv) or not os.path.isdir(self.argv[i + 1]):
+                        logging.error("No directory found after %s" % arg)
+                        self.help = True
+                        break
+                    values.add(i + 1)
+                    self.batch = self.argv[i + 1]
             else:
                 logging.error("Invalid argument: %s" % arg)
                 self.help = True
                 break
 
 
+# ------------------------------------------------------------------------------
+# Library API
+# ------------------------------------------------------------------------------
+def parse(*files, jobs=None, cache=False) -> HostInfo:
+    """
+    Parses one or more .gnmap/.xml files and returns a new HostInfo
+
+    More than one file is parsed in worker processes and merged the same as
+    -iL does. Nothing is shared between calls, so scans can be parsed at the
+    same time from threads. cache=True loads and saves the results in CACHEDIR
+
+    Raises ValueError for a file that isn't a .gnmap or .xml, OSError for a
+    file that can't be read
+    """
+    if not files:
+        raise ValueError("No input files given")
+    unsupported = [f for f in files if Stream.kind(f) not in SUPPORTEDFILES]
+    if unsupported:
+        raise ValueError("Unsupported input %s" % ", ".join(unsupported))
+    info = HostInfo()
+    info.inputFiles = list(files)
+    info.inputFile = info.inputFiles[0]
+    if cache and Cache.load(info):
+        return info
+    if len(files) > 1:
+        NmapParse.parse_many(info, info.inputFiles, jobs)
+    else:
+        NmapParse.parse_input(info, jobs)
+    if cache:
+        Cache.save(info)
+    return info
+
+
+def iter_hosts(file):
+    """
+    Yields (host, ports) for each live host in a .gnmap or .xml as it is read
+
+    Nothing is kept once a host is yielded, a host that is in the file more
+    than once is yielded each time
+    """
+    kind = Stream.kind(file)
+    if kind == "xml":
+        with Stream.open(file, "rb") as f:
+            yield from NmapParse.xml.records(f)
+    elif kind == "gnmap":
+        with Stream.open(file) as f:
+            yield from NmapParse.gnmap.records(f)
+    else:
+        raise ValueError("Unsupported input %s" % file)
+
+
+def export(info, directory=None, formats=None, flags=None) -> dict:
+    """
+    Writes info in formats (every registered format if not given) and
+    returns the Files.save_all report
+
+    directory defaults to the one -iL would use, flags are the writer options
+    such as compact_json and xml_indent, Flag([]) gives the defaults
+    """
+    import copy
+
+    flags = copy.copy(flags) if flags else Flag([])
+    if formats is not None:
+        flags.formats = list(formats)
+    if directory is None:
+        Files.set_save_dir(info, flags)
+    else:
+        info.saveDir = directory
+        info.saveDirPorts = directory + "/open_ports"
+    os.makedirs(info.saveDir, exist_ok=True)
+    if not flags.formats or "ports" in flags.formats:
+        os.makedirs(info.saveDirPorts, exist_ok=True)
+    return Files.save_all(info, flags)
+
+
 # ------------------------------------------------------------------------------
 # Options
 # ------------------------------------------------------------------------------
 class main:
-    def main() -> None:
-        if Flag.help:
+    def main(argv=None) -> None:
+        flags = Flag(argv)
+        main.header(flags)
+        Files.load_plugins(flags.plugins)
+        if flags.help:
             main.help_screen()
             sys.exit(1)
-        if Flag.clean:
+        if flags.clean:
             Files.clean_dir()
-        if Flag.inputFlag == False and HostInfo.inputFile == "":
-            logging.debug("No input file specified searching for file")
-            Files.find_input_file()
-        NmapParse.nmap_parser()
+        if flags.query:
+            main.query(flags)
+            return
+        if flags.diff:
+            main.diff(flags)
+            return
+        # Check --formats before spending time on the parse
+        try:
+            Files.select(flags.formats)
+        except ValueError as e:
+            logging.critical(e)
+            sys.exit(1)
+        if flags.batch:
+            main.batch(flags)
+            return
+        info = HostInfo()
+        if flags.inputFiles:
+            info.inputFiles = list(flags.inputFiles)
+            info.inputFile = info.inputFiles[0]
+        with Metrics.phase("input discovery", info):
+            if flags.inputFlag == False and info.inputFile == "":
+                logging.debug("No input file specified searching for file")
+                Files.find_input_file(info, flags)
+        if flags.follow:
+            main.follow(info, flags)
+            return
+        # --filter writes no results directory for the profile to go in
+        if flags.profile and not flags.filter:
+            Metrics.start_profile()
+        with Metrics.phase("cache load", info):
+            cached = flags.cache and Cache.load(info)
+        if not cached:
+            with Metrics.phase("parse", info):
+                NmapParse.nmap_parser(info, flags)
+            # update_host runs inside the parse, this is its share of it
+            Metrics.record("registry build", info, info.registryTime)
+            logging.info(
+                "Registry has %s services, %s tcp and %s udp ports",
+                len(info.service_registry),
+                info.numPors["tcp"],
+                info.numPors["udp"],
+            )
+            if flags.cache:
+                with Metrics.phase("cache save", info):
+                    Cache.save(info)
+        if flags.filter:
+            main.filter(info, flags)
+            return
 
-        Files.create_dir()
-        Files.save_all()
+        with Metrics.phase("create directory", info):
+            Files.create_dir(info, flags)
+        with Metrics.phase("save_all", info):
+            report = Files.save_all(info, flags)
+            for writer, result in report.items():
+                Metrics.record(
+                    "write " + writer,
+                    info,
+                    result["seconds"],
+                    result["cpu_seconds"],
+                    error=result["error"],
+                )
+        if flags.profile:
+            Metrics.stop_profile(info)
+            print(Metrics.summary())
+        Metrics.save(info)
 
         # Finish
-        print("Finished parsing, files created, check %s directory" % HostInfo.saveDir)
+        print("Finished parsing, files created, check %s directory" % info.saveDir)
+
+    def query(flags) -> None:
+        import sqlite3
+
+        database, filters = flags.query[0], flags.query[1:]
+        try:
+            conditions = Query.parse(filters)
+            found = 0
+            for host in Query.sql3(database, conditions):
+                print(host)
+                found += 1
+        except (ValueError, sqlite3.Error) as e:
+            logging.critical("Query failed (%s)" % e)
+            sys.exit(1)
+        logging.info("%s hosts matched %s" % (found, " ".join(filters)))
+
+    def filter(info, flags) -> None:
+        try:
+            conditions = Query.parse(flags.filter)
+        except ValueError as e:
+            logging.critical("Filter failed (%s)" % e)
+            sys.exit(1)
+        found = 0
+        for host in Query.index(info, conditions):
+            print(host)
+            found += 1
+        logging.info("%s hosts matched %s" % (found, " ".join(flags.filter)))
+
+    def diff(flags) -> None:
+        scans = []
+        for name, file in zip(["load old scan", "load new scan"], flags.diff):
+            start, cpu = time.perf_counter(), time.process_time()
+            try:
+                scans.append(Diff.load(file, flags.cache))
+            except Exception as e:
+                logging.critical("Could not load %s (%s)" % (file, e))
+                sys.exit(1)
+            Metrics.record(
+                name,
+                scans[-1],
+                time.perf_counter() - start,
+                time.process_time() - cpu,
+            )
+        old, new = scans
+        with Metrics.phase("diff", new):
+            diff = Diff.compare(old, new)
+        Files.create_dir(new, flags)
+        Diff.save(new, diff)
+        Metrics.save(new)
+        for line in Diff.text(diff):
+            if not line:
+                break
+            print(line)
+        print("Finished comparing, files created, check %s directory" % new.saveDir)
+
+    def batch(flags) -> None:
+        results = Batch.run(flags.batch, flags)
+        if not results:
+            logging.critical("No scans found under %s" % flags.batch)
+            sys.exit(1)
+        print(Batch.summary(results))
+        if any(result["status"] == "failed" for result in results):
+            sys.exit(1)
+
+    def follow(info, flags) -> None:
+        if (
+            len(info.inputFiles) > 1
+            or Stream.kind(info.inputFile) != "gnmap"
+            or Stream.compression(info.inputFile)
+        ):
+            logging.critical("--follow needs a single uncompressed .gnmap input file")
+            sys.exit(1)
+        Files.create_dir(info, flags)
+        try:
+            NmapParse.gnmap.follow(info, flags)
+        except KeyboardInterrupt:
+            logging.info("Stopped following %s" % info.inputFile)
+        info.sort_hosts()
+        Files.save_all(info, flags)
+        print("Finished following, files created, check %s directory" % info.saveDir)
 
     # ------------------------------------------------------------------------------
     # Help Screen
@@ -728,14 +3078,19 @@ class main:
         print("Usage: python3 Automate.py -iL <inputfile>")
         print("\nFlags:")
         print(Flag.__doc__)
+        print("Formats: %s" % ", ".join(Files.exporters))
         print("\nExamples:")
         print("\tpython3 Automate.py -iL input.gnmap")
+        print('\tpython3 Automate.py -iL node1.gnmap node2.xml "sweep/*.gnmap"')
+        print("\tpython3 Automate.py -d week1.gnmap week2.gnmap")
+        print("\tpython3 Automate.py -b scans/ -j 4")
+        print("\tpython3 Automate.py -iL input.gnmap --formats ports,json")
         sys.exit(0)
 
     # ------------------------------------------------------------------------------
     # Start of header section :TS
     # ------------------------------------------------------------------------------
-    def header() -> None:
+    def header(flags) -> None:
         """
         {2}#####################################################################
          _______ __   __ _______ _______ __   __ _______ _______ _______
@@ -749,7 +3104,7 @@ class main:
         #####################################################################{3}
         """
         logging.info("Starting Automate.py version %s" % VERSION)
-        if Flag.header is not True:
+        if flags.header is not True:
             return
         colors = [
             bcolors.OKBLUE,
@@ -770,8 +3125,6 @@ class main:
 ###############################################################################
 if __name__ == "__main__":
     start_time = time.time()
-    HostInfo = HostInfo()
-    Flag = Flag()
-    main.header()
+    Log.start()
     main.main()
     logging.info("Finished in %s seconds" % (time.time() - start_time))
@@ -0,0 +1,344 @@
+r"""Benchmarks for Automate.py on generated scans
+The functions:
+    generate_gnmap: Writes a .gnmap with a set number of hosts
+    generate_xml: Writes an Nmap .xml with a set number of hosts
+    run_scale: Times the parsers and every format registered in Automate.Files
+    main: Runs the benchmark
+Output:
+    RESULTSFILE: One JSON line per phase and scale, appended on every run
+Usage:
+    python3 Benchmark.py
+    python3 Benchmark.py --scales 1000,10000,100000,1000000 --ports 0-20
+By: Timothy Stowe
+"""
+
+import argparse
+import datetime
+import functools
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# ------------------------------------------------------------------------------
+# Settings
+# ------------------------------------------------------------------------------
+SCALES = [1000, 10000]  # Hosts per generated scan
+PORTS = (0, 8)  # Open ports per live host, picked at random in this range
+UPRATIO = 0.8  # Share of the hosts that are up
+SEED = 1337
+RESULTSFILE = "benchmark.jsonl"
+# (port, protocol, service, version)
+SERVICES = [
+    ("21", "tcp", "ftp", "vsftpd 3.0.3"),
+    (
+        "22",
+        "tcp",
+        "ssh",
+        "OpenSSH 8.2p1 Ubuntu 4ubuntu0.5 (Ubuntu Linux; protocol 2.0)",
+    ),
+    ("23", "tcp", "telnet", ""),
+    ("25", "tcp", "smtp", "Postfix smtpd"),
+    ("53", "tcp", "domain", "ISC BIND 9.16.1"),
+    ("53", "udp", "domain", ""),
+    ("80", "tcp", "http", "nginx 1.18.0"),
+    ("80", "tcp", "http", "Apache httpd 2.4.41"),
+    ("123", "udp", "ntp", ""),
+    ("135", "tcp", "msrpc", "Microsoft Windows RPC"),
+    ("139", "tcp", "netbios-ssn", "Microsoft Windows netbios-ssn"),
+    ("161", "udp", "snmp", "net-snmp; net-snmp SNMPv3 server"),
+    ("443", "tcp", "ssl|https", ""),
+    ("445", "tcp", "microsoft-ds", ""),
+    ("3306", "tcp", "mysql", "MySQL 8.0.28"),
+    ("3389", "tcp", "ms-wbt-server", "Microsoft Terminal Services"),
+    ("5432", "tcp", "postgresql", "PostgreSQL DB 12.9"),
+    ("8080", "tcp", "http-proxy", ""),
+    ("8443", "tcp", "https-alt", ""),
+    ("9100", "tcp", "jetdirect", ""),
+]
+
+
+# ------------------------------------------------------------------------------
+# Scan generators
+# ------------------------------------------------------------------------------
+def hosts(count, ports, seed=SEED):
+    """
+    Yields (ip, up, [(port, protocol, service, version), ...]) for count hosts
+
+    The same count, ports and seed always give the same hosts
+    """
+    rand = random.Random(seed)
+    for i in range(count):
+        ip = "10.%d.%d.%d" % (i // 65024 % 256, i // 254 % 256, i % 254 + 1)
+        if rand.random() > UPRATIO:
+            yield ip, False, []
+            continue
+        picked = {}
+        for service in rand.sample(SERVICES, min(rand.randint(*ports), len(SERVICES))):
+            picked.setdefault((service[0], service[1]), service)
+        yield ip, True, list(picked.values())
+
+
+def generate_gnmap(path, count, ports) -> None:
+    with open(path, "w") as f:
+        f.write("# Nmap 7.92 scan initiated as: nmap -sV -oA bench 10.0.0.0/8\n")
+        for ip, up, services in hosts(count, ports):
+            name = "host%s.bench.local" % ip.replace(".", "-")
+            f.write("Host: %s (%s)\tStatus: %s\n" % (ip, name, "Up" if up else "Down"))
+            if not services:
+                continue
+            entries = [
+                "%s/open/%s//%s//%s/" % (port, protocol, service, version)
+                for port, protocol, service, version in services
+            ]
+            f.write(
+                "Host: %s (%s)\tPorts: %s\tIgnored State: closed (%s)\n"
+                % (ip, name, ", ".join(entries), 1000 - len(entries))
+            )
+        f.write("# Nmap done -- %s IP addresses scanned\n" % count)
+
+
+def generate_xml(path, count, ports) -> None:
+    from xml.sax.saxutils import quoteattr
+
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE nmaprun>\n')
+        f.write('<nmaprun scanner="nmap" args="nmap -sV -oX bench.xml 10.0.0.0/8">\n')
+        f.write('<scaninfo type="syn" protocol="tcp" numservices="1000"/>\n')
+        for ip, up, services in hosts(count, ports):
+            f.write(
+                '<host><status state="%s" reason="syn-ack"/>\n'
+                % ("up" if up else "down")
+            )
+            f.write(
+                '<address addr="%s" addrtype="ipv4"/>\n<hostnames/>\n<ports>\n' % ip
+            )
+            for port, protocol, service, version in services:
+                f.write(
+                    '<port protocol="%s" portid="%s"><state state="open" reason="syn-ack"/>'
+                    '<service name=%s product=%s method="probed" conf="10"/>'
+                    '<script id="banner" output=%s/></port>\n'
+                    % (
+                        protocol,
+                        port,
+                        quoteattr(service),
+                        quoteattr(version),
+                        quoteattr(version * 4),
+                    )
+                )
+            f.write(
+                '</ports>\n<times srtt="1000" rttvar="500" to="100000"/>\n</host>\n'
+            )
+        f.write(
+            '<runstats><finished time="0"/><hosts total="%s"/></runstats>\n</nmaprun>\n'
+            % count
+        )
+
+
+# ------------------------------------------------------------------------------
+# Benchmark
+# ------------------------------------------------------------------------------
+def measure(func, memory=True) -> dict:
+    """
+    Runs func once for the time and once more under tracemalloc for the peak
+
+    Returns:
+        dict: {"seconds": float, "cpu_seconds": float, "peak_mb": float or None}
+    """
+    gc.collect()
+    wall, cpu = time.perf_counter(), time.process_time()
+    func()
+    result = {
+        "seconds": round(time.perf_counter() - wall, 4),
+        "cpu_seconds": round(time.process_time() - cpu, 4),
+        "peak_mb": None,
+    }
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            result["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024**2, 2)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run_scale(Automate, workdir, count, ports, memory=True, formats=None) -> list:
+    """
+    Generates a gnmap and an xml with count hosts, then times the xml parser,
+    both gnmap parsers (the memory map that plain files use and the line
+    reader that compressed files and --follow use) and the exporter of each
+    format on the parsed gnmap results, every registered format if formats
+    isn't given
+
+    A gnmap over SCANCHUNK is scanned by worker processes that tracemalloc
+    can't see, the workers field of that phase says how many there were
+
+    Returns:
+        list: One dict per phase
+    """
+    results = []
+    files = {}
+    for kind, generate in (("gnmap", generate_gnmap), ("xml", generate_xml)):
+        files[kind] = os.path.join(workdir, "bench_%s.%s" % (count, kind))
+        start = time.perf_counter()
+        generate(files[kind], count, ports)
+        print(
+            "  generated %s in %.2fs"
+            % (os.path.basename(files[kind]), time.perf_counter() - start)
+        )
+
+    parsed = {}
+
+    def parse(phase, kind, file):
+        def run():
+            info = Automate.HostInfo()
+            info.inputFile = file
+            info.inputFiles = [file]
+            if phase == "NmapParse.gnmap.parse":
+                with Automate.Stream.open(file) as f:
+                    Automate.NmapParse.gnmap.parse(info, f)
+            else:
+                Automate.NmapParse.parse_input(info)
+            parsed[phase] = info
+
+        return run
+
+    # The same worker count parse_mmap picks
+    workers = min(
+        os.cpu_count() or 1, os.path.getsize(files["gnmap"]) // Automate.SCANCHUNK
+    )
+    for phase, kind in (
+        ("NmapParse.xml.parse", "xml"),
+        ("NmapParse.gnmap.parse_mmap", "gnmap"),
+        ("NmapParse.gnmap.parse", "gnmap"),
+    ):
+        result = measure(parse(phase, kind, files[kind]), memory)
+        info = parsed[phase]
+        result.update(
+            phase=phase,
+            input_bytes=os.path.getsize(files[kind]),
+            hosts=len(info.host_dict),
+            ports=sum(len(p) for p in info.host_dict.values()),
+            workers=workers if phase.endswith("parse_mmap") and workers > 1 else 0,
+        )
+        results.append(result)
+        print("  %-32s %8.3fs" % (phase, result["seconds"]))
+        if result["workers"] and result["peak_mb"] is not None:
+            print(
+                "  %-32s peak_mb leaves out %s worker processes"
+                % ("", result["workers"])
+            )
+
+    # The gnmap results are what the exporters write
+    info, flags = parsed["NmapParse.gnmap.parse_mmap"], Automate.Flag([])
+    info.saveDir = os.path.join(workdir, "bench_%s_nmap_results" % count)
+    info.saveDirPorts = info.saveDir + "/open_ports"
+    os.makedirs(info.saveDirPorts, exist_ok=True)
+    for name in formats or list(Automate.Files.exporters):
+        writer = Automate.Files.writer(name)
+        phase = "Files.%s" % writer.__name__
+        result = measure(functools.partial(writer, info, flags), memory)
+        result.update(
+            phase=phase,
+            format=name,
+            hosts=len(info.host_dict),
+            ports=sum(len(p) for p in info.host_dict.values()),
+        )
+        results.append(result)
+        print("  %-32s %8.3fs" % (phase, result["seconds"]))
+    shutil.rmtree(info.saveDir, ignore_errors=True)
+    for path in files.values():
+        os.remove(path)
+    return results
+
+
+def options():
+    parser = argparse.ArgumentParser(
+        description="Benchmark Automate.py on generated scans"
+    )
+    parser.add_argument(
+        "--scales",
+        default=",".join(str(s) for s in SCALES),
+        help="Comma separated host counts (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--ports",
+        default="%s-%s" % PORTS,
+        help="Open ports per live host as min-max (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        default=RESULTSFILE,
+        help="JSON lines file the results are appended to (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workdir", help="Where the scans are generated (default: a temp dir)"
+    )
+    parser.add_argument(
+        "--formats",
+        help="Comma separated formats to time (default: every registered format)",
+    )
+    parser.add_argument(
+        "--plugin",
+        action="append",
+        default=[],
+        help="Module or .py file that registers more formats, can be given again",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Skip the second tracemalloc run of every phase",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = options()
+    scales = [int(s) for s in args.scales.split(",") if s]
+    ports = tuple(int(p) for p in args.ports.split("-"))
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="automate_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import Automate
+
+    Automate.Files.load_plugins(args.plugin)
+    formats = [f for f in (args.formats or "").split(",") if f] or None
+    # Check the formats before anything is generated
+    try:
+        Automate.Files.select(formats)
+    except ValueError as e:
+        sys.exit(e)
+
+    run = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "version": Automate.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ports_per_host": "%s-%s" % ports,
+    }
+    with open(output, "a") as f:
+        for count in scales:
+            print("%s hosts" % count)
+            for result in run_scale(
+                Automate, workdir, count, ports, not args.no_memory, formats
+            ):
+                f.write(json.dumps(dict(run, scale=count, **result)) + "\n")
+                f.flush()
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("Results appended to %s" % output)
+
+
+###############################################################################
+if __name__ == "__main__":
+    main()